@@ -7,11 +7,11 @@ from flask_bootstrap import Bootstrap
 from flask_login import LoginManager
 from flask_mail import Mail
 from flask_migrate import Migrate
-from flask_sqlalchemy import SQLAlchemy
 
 from app.config import Config
+from app.replicas import RoutingSQLAlchemy
 
-db = SQLAlchemy()
+db = RoutingSQLAlchemy()
 migrate = Migrate()
 bcrypt = Bcrypt()
 login_manager = LoginManager()
@@ -23,7 +23,8 @@ mail = Mail()
 
 def create_app(config_class=Config):
     app = Flask(__name__)
-    app.config.from_object(Config)
+    app.config.from_object(config_class)
+    config_class.init_app(app)
 
     from app.errors.handlers import errors
     from app.main.routes import main
@@ -39,6 +40,44 @@ def create_app(config_class=Config):
     login_manager.init_app(app)
     mail.init_app(app)
     migrate.init_app(app, db)
+
+    from app.replicas import replicas
+
+    replicas.init_app(app)
+
+    from app.usercache import user_cache
+
+    user_cache.init_app(app)
+
+    from app.followgraph import follow_graph
+
+    follow_graph.init_app(app)
+
+    from app.availability import availability
+
+    availability.init_app(app)
+
+    from app.metrics import metrics
+
+    metrics.init_app(app)
+    metrics.register_collector(user_cache.collect)
+    metrics.register_collector(availability.collect)
+
+    from app.pool import pool_stats
+
+    metrics.register_collector(pool_stats.collect)
+
+    from app.cache import cache
+
+    cache.init_app(app)
+
+    from app.profiler import profiler
+
+    profiler.init_app(app)
+
+    from app.assets import assets
+
+    assets.init_app(app)
     if app.config["SSL_REDIRECT"]:
         from flask_sslify import SSLify
 
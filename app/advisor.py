@@ -0,0 +1,136 @@
+"""``flask advise``: find the pages' queries that scan whole tables.
+
+The command turns on Flask-SQLAlchemy's query recording, requests the main
+pages through the test client as an existing user, and runs ``EXPLAIN`` on
+every distinct SELECT they issued. Sequential scans of tables with at least
+``--min-rows`` rows are reported together with the pages that caused them.
+"""
+import json
+
+import click
+from flask import current_app, request, request_finished
+from flask.cli import with_appcontext
+from flask_sqlalchemy import get_debug_queries
+
+from app import db
+from app.metrics import statement_shape
+from app.models import Post, User
+
+
+def _pages(user, post):
+    return [
+        "/home",
+        f"/post/{post.id}",
+        f"/following/{user.id}",
+        f"/user/{post.user_id}",
+        "/account",
+    ]
+
+
+def _explain(cursor, dialect, statement, parameters):
+    """Return the tables the plan reads without an index."""
+    if dialect == "postgresql":
+        cursor.execute("EXPLAIN (FORMAT JSON) " + statement, parameters)
+        plan = cursor.fetchone()[0]
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        tables = []
+        nodes = [plan[0]["Plan"]]
+        while nodes:
+            node = nodes.pop()
+            if node["Node Type"] == "Seq Scan":
+                tables.append(node["Relation Name"])
+            nodes.extend(node.get("Plans", ()))
+        return tables
+    cursor.execute("EXPLAIN QUERY PLAN " + statement, parameters)
+    tables = []
+    for row in cursor.fetchall():
+        words = row[-1].split()
+        # "SCAN posts" reads the table, "SCAN posts USING INDEX ..." does not
+        if words[0] == "SCAN" and "USING" not in words:
+            tables.append(words[1])
+    return tables
+
+
+def _row_counts(cursor, tables):
+    counts = {}
+    for table in tables:
+        cursor.execute(f"SELECT count(*) FROM {table}")
+        counts[table] = cursor.fetchone()[0]
+    return counts
+
+
+@click.command("advise")
+@click.option("--user-id", type=int, help="User to browse as (default: first).")
+@click.option("--url", "urls", multiple=True, help="Extra pages to request.")
+@click.option(
+    "--min-rows", default=1000, show_default=True, help="Ignore smaller tables."
+)
+@with_appcontext
+def advise_cli(user_id, urls, min_rows):
+    """Report sequential scans in the queries behind the main pages."""
+    app = current_app._get_current_object()
+    # read when the engine is created, so before the first query
+    app.config["SQLALCHEMY_RECORD_QUERIES"] = True
+
+    user = User.query.get(user_id) if user_id else User.query.first()
+    post = Post.query.first()
+    if user is None or post is None:
+        raise click.ClickException("the database needs a user and a post")
+
+    statements = {}
+
+    def record(sender, response, **extra):
+        for query in get_debug_queries():
+            if not query.statement.lstrip().upper().startswith("SELECT"):
+                continue
+            shape = statement_shape(query.statement)
+            entry = statements.setdefault(
+                shape, {"statement": query.statement, "parameters": query.parameters}
+            )
+            entry.setdefault("pages", set()).add(request.path)
+
+    request_finished.connect(record, app)
+    try:
+        client = app.test_client()
+        with client.session_transaction() as session:
+            session["_user_id"] = str(user.id)
+            session["_fresh"] = True
+        for url in [*_pages(user, post), *urls]:
+            # a fresh app context per page, so its recorded queries are its own
+            with app.app_context():
+                status = client.get(url).status_code
+            click.echo(f"GET {url} {status}", err=True)
+    finally:
+        request_finished.disconnect(record, app)
+
+    dialect = db.engine.dialect.name
+    connection = db.engine.raw_connection()
+    try:
+        cursor = connection.cursor()
+        findings = []
+        for entry in statements.values():
+            tables = _explain(cursor, dialect, entry["statement"], entry["parameters"])
+            if tables:
+                findings.append((tables, entry))
+        counts = _row_counts(cursor, {t for tables, _ in findings for t in tables})
+    finally:
+        connection.close()
+
+    reported = 0
+    for tables, entry in findings:
+        large = [t for t in tables if counts[t] >= min_rows]
+        if not large:
+            continue
+        reported += 1
+        click.echo(
+            "Sequential scan of "
+            + ", ".join(f"{t} ({counts[t]} rows)" for t in large)
+            + " from "
+            + ", ".join(sorted(entry["pages"]))
+        )
+        click.echo("  " + " ".join(entry["statement"].split()))
+    click.echo(
+        f"{len(statements)} distinct statements, {reported} with sequential "
+        f"scans of tables over {min_rows} rows"
+    )
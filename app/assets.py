@@ -0,0 +1,166 @@
+"""Fingerprinted, precompressed static files.
+
+``flask assets build`` copies every file under ``app/static`` to
+``app/static/dist`` under a name that contains a hash of its content, with
+``.gz`` and, if the ``brotli`` package is installed, ``.br`` siblings for
+text files, and records the mapping in ``dist/manifest.json``. Once the
+manifest exists, ``url_for('static', ...)`` links the hashed copies. Those
+are served with a year-long ``immutable`` Cache-Control, using the
+precompressed variant the browser accepts. Files missing from the manifest,
+such as freshly uploaded pictures, are served as before.
+
+Old hashed files are kept on rebuild so pages cached before a deploy keep
+working; ``--clean`` removes them.
+"""
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+
+import click
+from flask import current_app, request, send_from_directory
+from flask.cli import AppGroup
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSIBLE = {".css", ".js", ".svg", ".json", ".txt", ".html", ".map"}
+ENCODINGS = ((".br", "br"), (".gz", "gzip"))
+
+assets_cli = AppGroup("assets", help="Build fingerprinted static files.")
+
+
+class Assets:
+    def __init__(self):
+        self.manifest = {}
+        self.prefix = "dist"
+        self.max_age = 31536000
+
+    def init_app(self, app):
+        self.prefix = app.config["ASSETS_DIR"]
+        self.max_age = app.config["ASSETS_MAX_AGE"]
+        self.manifest = self.load(app)
+        app.url_defaults(self.rewrite)
+        app.view_functions["static"] = self.send_static_file
+
+    def output_dir(self, app):
+        return os.path.join(app.static_folder, self.prefix)
+
+    def load(self, app):
+        try:
+            with open(os.path.join(self.output_dir(app), "manifest.json")) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+
+    def rewrite(self, endpoint, values):
+        if endpoint == "static" and values.get("filename") in self.manifest:
+            values["filename"] = self.manifest[values["filename"]]
+
+    def send_static_file(self, filename):
+        app = current_app
+        if not filename.startswith(self.prefix + "/"):
+            return app.send_static_file(filename)
+        mimetype, _ = mimetypes.guess_type(filename)
+        for suffix, encoding in ENCODINGS:
+            if encoding in request.accept_encodings and os.path.isfile(
+                os.path.join(app.static_folder, filename + suffix)
+            ):
+                response = send_from_directory(
+                    app.static_folder,
+                    filename + suffix,
+                    mimetype=mimetype,
+                    download_name=os.path.basename(filename),
+                    max_age=self.max_age,
+                )
+                response.headers["Content-Encoding"] = encoding
+                break
+        else:
+            response = send_from_directory(
+                app.static_folder, filename, max_age=self.max_age
+            )
+        response.vary.add("Accept-Encoding")
+        response.cache_control.immutable = True
+        return response
+
+
+assets = Assets()
+
+
+def _write(path, data):
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def build(app):
+    """Write the hashed and compressed copies; returns the new manifest."""
+    output_dir = assets.output_dir(app)
+    manifest = {}
+    for root, dirs, files in os.walk(app.static_folder):
+        if root == app.static_folder:
+            dirs[:] = [d for d in dirs if d != assets.prefix]
+        for name in files:
+            path = os.path.join(root, name)
+            source = os.path.relpath(path, app.static_folder).replace(os.sep, "/")
+            with open(path, "rb") as f:
+                data = f.read()
+            stem, ext = os.path.splitext(source)
+            digest = hashlib.sha256(data).hexdigest()[:12]
+            target = f"{stem}.{digest}{ext}"
+            manifest[source] = f"{assets.prefix}/{target}"
+            out = os.path.join(output_dir, target)
+            if os.path.exists(out):
+                continue
+            os.makedirs(os.path.dirname(out), exist_ok=True)
+            _write(out, data)
+            if ext.lower() not in COMPRESSIBLE:
+                continue
+            compressed = {".gz": gzip.compress(data, compresslevel=9, mtime=0)}
+            if brotli is not None:
+                compressed[".br"] = brotli.compress(data)
+            for suffix, body in compressed.items():
+                if len(body) < len(data):
+                    _write(out + suffix, body)
+    os.makedirs(output_dir, exist_ok=True)
+    _write(
+        os.path.join(output_dir, "manifest.json"),
+        json.dumps(manifest, indent=2, sort_keys=True).encode(),
+    )
+    return manifest
+
+
+def clean(app, manifest):
+    """Remove hashed files that the manifest no longer refers to."""
+    output_dir = assets.output_dir(app)
+    keep = {"manifest.json"}
+    for target in manifest.values():
+        target = target[len(assets.prefix) + 1 :]
+        keep.update(target + suffix for suffix in ("", ".gz", ".br"))
+    removed = 0
+    for root, _, files in os.walk(output_dir):
+        for name in files:
+            path = os.path.join(root, name)
+            relative = os.path.relpath(path, output_dir).replace(os.sep, "/")
+            if relative not in keep:
+                os.remove(path)
+                removed += 1
+    return removed
+
+
+@assets_cli.command("build")
+@click.option("--clean", "remove_old", is_flag=True, help="Drop stale hashed files.")
+def build_cli(remove_old):
+    """Fingerprint and precompress app/static into app/static/dist."""
+    app = current_app._get_current_object()
+    if brotli is None:
+        click.echo("brotli is not installed; writing .gz files only", err=True)
+    manifest = build(app)
+    assets.manifest = manifest
+    click.echo(f"{len(manifest)} files in {assets.output_dir(app)}")
+    if remove_old:
+        click.echo(f"removed {clean(app, manifest)} stale files")
@@ -0,0 +1,206 @@
+"""Username and email availability behind a Bloom filter.
+
+Each process keeps a Bloom filter of every username and email in the users
+table. A value the filter has never seen is free without asking the
+database; only possible hits (taken values and the rare false positive)
+are looked up, both fields in one query. The filter is built from the
+table on first use and extended after commits that insert users or change
+their username or email. Other workers receive those changes through an
+:class:`app.changelog.Changelog`. A Bloom filter cannot forget, so values
+that are no longer used only cost the database lookup they would have
+cost anyway.
+
+The changelog only reaches the workers on one host, so the filter can miss
+values registered elsewhere. It answers the registration form's live hint;
+the registration itself asks the database with ``prefilter=False``.
+"""
+import hashlib
+import math
+import os
+import threading
+from urllib.parse import quote, unquote
+
+from sqlalchemy import event, inspect, or_, select
+from sqlalchemy.orm import Session, object_session
+
+from app import db
+from app.changelog import Changelog
+
+FIELDS = ("username", "email")
+
+
+class BloomFilter:
+    def __init__(self, capacity, error_rate):
+        bits = math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)
+        self.size = max(bits, 8)
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, value):
+        digest = hashlib.blake2b(value.encode("utf-8"), digest_size=16).digest()
+        # double hashing: k positions from two 64-bit halves
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def add(self, value):
+        for position in self._positions(value):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, value):
+        return all(
+            self.bits[position >> 3] & (1 << (position & 7))
+            for position in self._positions(value)
+        )
+
+
+class Availability:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.filter = None
+        self.log = None
+        self.pid = None
+        self.capacity = 1000000
+        self.error_rate = 0.001
+        self.checks = 0
+        self.lookups = 0
+        self.false_positives = 0
+
+    def init_app(self, app):
+        self.capacity = app.config["AVAILABILITY_CAPACITY"]
+        self.error_rate = app.config["AVAILABILITY_ERROR_RATE"]
+        self.log = Changelog(
+            app.config["AVAILABILITY_LOG"], app.config["AVAILABILITY_LOG_SIZE"]
+        )
+        self.pid = None
+
+    def watch(self, model):
+        """Add the usernames and emails a commit inserts or changes."""
+
+        def mark(mapper, connection, target):
+            session = object_session(target)
+            for field in FIELDS:
+                history = inspect(target).attrs[field].history
+                if history.added and getattr(target, field):
+                    session.info.setdefault("availability", []).append(
+                        (field, quote(getattr(target, field), safe=""))
+                    )
+
+        event.listen(model, "after_insert", mark)
+        event.listen(model, "after_update", mark)
+
+    @staticmethod
+    def _key(field, value):
+        return f"{field}:{value}"
+
+    def _rebuild(self):
+        self.log.mark()
+        bloom = BloomFilter(self.capacity, self.error_rate)
+        users = db.metadata.tables["users"]
+        # from the primary, like the lookups: values a lagging replica lacks
+        # would read as free until the next rebuild
+        rows = db.session.execute(
+            select(users.c.username, users.c.email).execution_options(
+                include_deleted=True, stream_results=True, use_primary=True
+            )
+        )
+        for row in rows:
+            for field in FIELDS:
+                if getattr(row, field):
+                    bloom.add(self._key(field, getattr(row, field)))
+        self.filter = bloom
+        self.pid = os.getpid()
+
+    def _sync(self):
+        with self.lock:
+            if self.pid != os.getpid():
+                self._rebuild()
+                return
+            entries = self.log.read()
+            if entries is None:
+                self._rebuild()
+                return
+            for field, value in entries:
+                self.filter.add(self._key(field, unquote(value)))
+
+    def taken(self, prefilter=True, **values):
+        """Return the fields among ``username``/``email`` whose value is used.
+
+        Without ``prefilter`` every value is looked up, skipping the filter.
+        """
+        from app.models import User
+
+        values = {field: value for field, value in values.items() if value}
+        if prefilter:
+            self._sync()
+            candidates = {
+                field: value
+                for field, value in values.items()
+                if self._key(field, value) in self.filter
+            }
+        else:
+            candidates = values
+        with self.lock:
+            self.checks += 1
+            if candidates:
+                self.lookups += 1
+        if not candidates:
+            return set()
+        rows = (
+            db.session.query(User.username, User.email)
+            .filter(
+                or_(
+                    *(
+                        getattr(User, field) == value
+                        for field, value in candidates.items()
+                    )
+                )
+            )
+            .execution_options(use_primary=True)
+            .all()
+        )
+        taken = {
+            field
+            for field, value in candidates.items()
+            if any(getattr(row, field) == value for row in rows)
+        }
+        if prefilter and len(taken) < len(candidates):
+            with self.lock:
+                self.false_positives += len(candidates) - len(taken)
+        return taken
+
+    def publish(self, changes):
+        if changes:
+            self.log.append(*changes)
+
+    def invalidate(self):
+        """Rebuild everywhere, e.g. after users were written in bulk."""
+        self.log.rotate()
+
+    def collect(self):
+        with self.lock:
+            counts = {
+                "checks": self.checks,
+                "lookups": self.lookups,
+                "false_positives": self.false_positives,
+            }
+        for name, value in counts.items():
+            yield (
+                f"blog_availability_{name}_total",
+                "counter",
+                f"Availability {name.replace('_', ' ')}.",
+                [({}, value)],
+            )
+
+
+availability = Availability()
+
+
+@event.listens_for(Session, "after_commit")
+def _publish_committed(session):
+    availability.publish(session.info.pop("availability", None))
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def _forget_rolled_back(session, previous_transaction):
+    session.info.pop("availability", None)
@@ -0,0 +1,348 @@
+"""Load benchmark: ``flask bench``.
+
+Seeds a reproducible dataset with Faker, then drives the real views through
+the WSGI test client from many threads and prints a JSON report with
+throughput, latency percentiles and SQL statements per request per scenario,
+so two releases can be compared with a plain diff.
+"""
+import json
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import click
+from faker import Faker
+from flask import g, request_finished
+
+from app import bcrypt, create_app, db
+from app.availability import availability
+from app.config import Config, TestingConfig
+from app.counters import recount
+from app.followgraph import follow_graph
+from app.markup import excerpt, render
+from app.models import Comment, Follow, Like, Post, Role, User
+from app.timeline import rebuild
+
+PASSWORD = "benchmark"
+DEFAULT_DATABASE = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), os.pardir, "tmp", "bench.db"
+)
+
+SCENARIOS = {
+    "home": 30,
+    "post": 20,
+    "following": 12,
+    "user": 12,
+    "like": 10,
+    "newpost": 8,
+    "login": 8,
+}
+
+
+def _insert(table, rows, chunk_size):
+    """Insert an iterable of row dicts with one executemany per chunk."""
+    chunk = []
+    count = 0
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == chunk_size:
+            db.session.execute(table.insert(), chunk)
+            db.session.commit()
+            count += len(chunk)
+            chunk = []
+    if chunk:
+        db.session.execute(table.insert(), chunk)
+        db.session.commit()
+        count += len(chunk)
+    click.echo(f"  {table.name}: {count} rows", err=True)
+    return count
+
+
+def seed(users, posts, follows, likes, comments, seed=0, chunk_size=10000):
+    """Recreate the schema and fill it; ids are assigned 1..n in insert order."""
+    fake = Faker()
+    fake.seed_instance(seed)
+    rng = random.Random(seed)
+    # generating text is far slower than inserting it, so draw from pools
+    titles = [fake.sentence(nb_words=6)[:80] for _ in range(1000)]
+    bodies = [fake.paragraph(nb_sentences=6) for _ in range(1000)]
+    remarks = [fake.sentence(nb_words=12) for _ in range(1000)]
+    # the inserts bypass the ORM events that render Markdown
+    bodies = [
+        {
+            "content": text,
+            "content_html": render(text),
+            "excerpt": excerpt(render(text)),
+        }
+        for text in bodies
+    ]
+    remarks = [{"body": text, "body_html": render(text)} for text in remarks]
+    names = [fake.user_name()[:16] for _ in range(1000)]
+    password = bcrypt.generate_password_hash(PASSWORD).decode("utf-8")
+    now = datetime.utcnow()
+
+    def moment():
+        return now - timedelta(seconds=rng.randint(0, 365 * 24 * 3600))
+
+    db.drop_all()
+    db.create_all()
+    Role.insert_roles()
+    role_id = Role.query.filter_by(default=True).first().id
+
+    counts = {}
+    counts["users"] = _insert(
+        User.__table__,
+        (
+            {
+                "username": f"{rng.choice(names)}{i}",
+                "email": f"user{i}@example.com",
+                "password": password,
+                "member_since": moment(),
+                "confirmed": True,
+                "role_id": role_id,
+            }
+            for i in range(1, users + 1)
+        ),
+        chunk_size,
+    )
+    counts["posts"] = _insert(
+        Post.__table__,
+        (
+            {
+                "title": rng.choice(titles),
+                **rng.choice(bodies),
+                "date_posted": moment(),
+                "user_id": rng.randint(1, users),
+            }
+            for _ in range(posts)
+        ),
+        chunk_size,
+    )
+    counts["follows"] = _insert(
+        Follow.__table__,
+        (
+            {"follower_id": user_id, "followed_id": followed_id, "timestamp": now}
+            for user_id in range(1, users + 1)
+            for followed_id in rng.sample(range(1, users + 1), min(follows, users))
+            if followed_id != user_id
+        ),
+        chunk_size,
+    )
+    counts["likes"] = _insert(
+        Like.__table__,
+        (
+            {"user_id": user_id, "post_id": post_id}
+            for user_id in range(1, users + 1)
+            for post_id in rng.sample(range(1, posts + 1), min(likes, posts))
+        ),
+        chunk_size,
+    )
+    counts["comments"] = _insert(
+        Comment.__table__,
+        (
+            {
+                **rng.choice(remarks),
+                "timestamp": moment(),
+                "author_id": rng.randint(1, users),
+                "post_id": rng.randint(1, posts),
+            }
+            for _ in range(comments)
+        ),
+        chunk_size,
+    )
+    rebuild()
+    recount()
+    db.session.commit()
+    follow_graph.invalidate()
+    availability.invalidate()
+    return counts
+
+
+def percentile(ordered, fraction):
+    if not ordered:
+        return None
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def summarize(samples, elapsed):
+    latencies = sorted(seconds for seconds, _, _ in samples)
+    queries = [n for _, _, n in samples if n is not None]
+    return {
+        "requests": len(samples),
+        "errors": sum(1 for _, ok, _ in samples if not ok),
+        "throughput": round(len(samples) / elapsed, 2),
+        "latency_ms": {
+            "mean": round(1000 * sum(latencies) / len(latencies), 2),
+            "p50": round(1000 * percentile(latencies, 0.50), 2),
+            "p95": round(1000 * percentile(latencies, 0.95), 2),
+            "p99": round(1000 * percentile(latencies, 0.99), 2),
+        },
+        "queries_per_request": {
+            "mean": round(sum(queries) / len(queries), 2) if queries else None,
+            "max": max(queries) if queries else None,
+        },
+    }
+
+
+class Driver:
+    def __init__(self, app, users, posts, rng):
+        self.app = app
+        self.users = users
+        self.posts = posts
+        self.rng = rng
+        self.local = threading.local()
+        request_finished.connect(self._finished, app)
+
+    def _finished(self, sender, response, **extra):
+        stats = g.get("request_stats")
+        self.local.queries = stats["blog_request_queries"] if stats else None
+
+    def login(self, client, user_id):
+        return client.post(
+            "/login",
+            data={"email": f"user{user_id}@example.com", "password": PASSWORD},
+        )
+
+    def call(self, client, user_id, scenario, arg):
+        if scenario == "home":
+            return client.get("/home")
+        if scenario == "post":
+            return client.get(f"/post/{arg}")
+        if scenario == "following":
+            return client.get(f"/following/{user_id}")
+        if scenario == "user":
+            return client.get(f"/user/{arg}")
+        if scenario == "like":
+            return client.get(f"/like/{arg}")
+        if scenario == "newpost":
+            return client.post(
+                "/newpost", data={"title": f"bench {arg}", "content": "benchmark"}
+            )
+        if scenario == "login":
+            # a fresh client, since a logged in one is just redirected
+            return self.login(self.app.test_client(), user_id)
+        raise ValueError(scenario)
+
+    def run_client(self, user_id, plan):
+        client = self.app.test_client()
+        self.login(client, user_id)
+        samples = []
+        for scenario, arg in plan:
+            self.local.queries = None
+            start = time.perf_counter()
+            try:
+                ok = self.call(client, user_id, scenario, arg).status_code < 400
+            except Exception:
+                ok = False
+            samples.append(
+                (scenario, time.perf_counter() - start, ok, self.local.queries)
+            )
+        return samples
+
+    def plans(self, clients, requests):
+        names = list(SCENARIOS)
+        weights = list(SCENARIOS.values())
+        for _ in range(clients):
+            steps = []
+            for scenario in self.rng.choices(names, weights, k=requests // clients):
+                if scenario == "user":
+                    arg = self.rng.randint(1, self.users)
+                else:
+                    arg = self.rng.randint(1, self.posts)
+                steps.append((scenario, arg))
+            yield self.rng.randint(1, self.users), steps
+
+
+@click.command("bench")
+@click.option(
+    "--database-uri",
+    default=f"sqlite:///{DEFAULT_DATABASE}",
+    help="Defaults to a SQLite file under tmp/.",
+)
+@click.option("--users", default=1000, show_default=True)
+@click.option("--posts", default=10000, show_default=True)
+@click.option("--follows", default=20, show_default=True, help="Per user.")
+@click.option("--likes", default=20, show_default=True, help="Per user.")
+@click.option("--comments", default=20000, show_default=True)
+@click.option("--clients", default=16, show_default=True)
+@click.option("--requests", default=2000, show_default=True)
+@click.option("--seed", "random_seed", default=0, show_default=True)
+@click.option(
+    "--reseed/--no-reseed",
+    default=True,
+    help="Recreate the dataset, or reuse the one already in the database.",
+)
+@click.option("--output", type=click.File("w"), default="-")
+def bench_cli(
+    database_uri,
+    users,
+    posts,
+    follows,
+    likes,
+    comments,
+    clients,
+    requests,
+    random_seed,
+    reseed,
+    output,
+):
+    """Seed a dataset and load test the main pages."""
+    if database_uri == Config.SQLALCHEMY_DATABASE_URI:
+        raise click.UsageError("refusing to benchmark the application database")
+
+    class BenchConfig(TestingConfig):
+        SQLALCHEMY_DATABASE_URI = database_uri
+        # every read goes to the seeded database, not the app's replicas
+        SQLALCHEMY_REPLICA_URIS = []
+        SQLALCHEMY_BINDS = None
+
+    app = create_app(BenchConfig)
+
+    with app.app_context():
+        counts = None
+        if reseed:
+            click.echo("Seeding", err=True)
+            start = time.perf_counter()
+            counts = seed(users, posts, follows, likes, comments, random_seed)
+            click.echo(f"  done in {time.perf_counter() - start:.1f}s", err=True)
+        users = db.session.query(db.func.max(User.id)).scalar()
+        posts = db.session.query(db.func.max(Post.id)).scalar()
+        dialect = db.engine.dialect.name
+        db.session.remove()
+
+    click.echo(f"Running {requests} requests from {clients} clients", err=True)
+    driver = Driver(app, users, posts, random.Random(random_seed))
+    start = time.perf_counter()
+    with ThreadPoolExecutor(clients) as pool:
+        results = list(
+            pool.map(
+                lambda args: driver.run_client(*args),
+                list(driver.plans(clients, requests)),
+            )
+        )
+    elapsed = time.perf_counter() - start
+
+    by_scenario = {}
+    for samples in results:
+        for scenario, seconds, ok, queries in samples:
+            by_scenario.setdefault(scenario, []).append((seconds, ok, queries))
+    report = {
+        "database": dialect,
+        "dataset": counts or {"users": users, "posts": posts},
+        "seed": random_seed,
+        "clients": clients,
+        "elapsed_seconds": round(elapsed, 3),
+        "overall": summarize(
+            [sample for samples in by_scenario.values() for sample in samples],
+            elapsed,
+        ),
+        "scenarios": {
+            scenario: summarize(samples, elapsed)
+            for scenario, samples in sorted(by_scenario.items())
+        },
+    }
+    json.dump(report, output, indent=2, sort_keys=True)
+    output.write("\n")
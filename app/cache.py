@@ -0,0 +1,202 @@
+"""Fragment cache for rendered template snippets.
+
+Fragments are keyed by the version stamps of the entities they show, e.g.
+``("post", 3)`` and ``("user", 7)``. Writers bump a stamp and every fragment
+built from the old one is simply never looked up again, so nothing has to be
+deleted. Stamps are microsecond timestamps, which also makes them usable as
+Last-Modified values.
+
+Two backends are available: ``memory`` is a per-process LRU, ``sqlite`` is a
+file shared by all workers on the host (and the one to use with more than
+one worker, as stamps bumped in one process must be seen by the others).
+"""
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from markupsafe import Markup
+
+
+def _now_us():
+    return time.time_ns() // 1000
+
+
+class MemoryBackend:
+    def __init__(self, maxsize=10000):
+        self.maxsize = maxsize
+        self.fragments = OrderedDict()
+        self.versions = {}
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            value = self.fragments.get(key)
+            if value is not None:
+                self.fragments.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self.lock:
+            self.fragments[key] = value
+            self.fragments.move_to_end(key)
+            while len(self.fragments) > self.maxsize:
+                self.fragments.popitem(last=False)
+
+    def get_versions(self, keys):
+        with self.lock:
+            return {key: self.versions[key] for key in keys if key in self.versions}
+
+    def version(self, key):
+        with self.lock:
+            return self.versions.setdefault(key, _now_us())
+
+    def bump(self, key):
+        with self.lock:
+            version = max(_now_us(), self.versions.get(key, 0) + 1)
+            self.versions[key] = version
+            return version
+
+
+class SQLiteBackend:
+    def __init__(self, path, maxsize=100000):
+        self.path = path
+        self.maxsize = maxsize
+        self.local = threading.local()
+        self.writes = 0
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with self._connection() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS fragments "
+                "(key TEXT PRIMARY KEY, value TEXT NOT NULL, stored INTEGER NOT NULL)"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS versions "
+                "(key TEXT PRIMARY KEY, value INTEGER NOT NULL)"
+            )
+
+    def _connection(self):
+        conn = getattr(self.local, "conn", None)
+        if conn is None or self.local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self.local.conn = conn
+            self.local.pid = os.getpid()
+        return conn
+
+    def get(self, key):
+        row = (
+            self._connection()
+            .execute("SELECT value FROM fragments WHERE key = ?", (key,))
+            .fetchone()
+        )
+        return row[0] if row else None
+
+    def set(self, key, value):
+        conn = self._connection()
+        conn.execute(
+            "INSERT OR REPLACE INTO fragments (key, value, stored) VALUES (?, ?, ?)",
+            (key, value, _now_us()),
+        )
+        self.writes += 1
+        if self.writes % 1000 == 0:
+            conn.execute(
+                "DELETE FROM fragments WHERE key IN (SELECT key FROM fragments "
+                "ORDER BY stored DESC LIMIT -1 OFFSET ?)",
+                (self.maxsize,),
+            )
+
+    def get_versions(self, keys):
+        keys = list(keys)
+        if not keys:
+            return {}
+        rows = self._connection().execute(
+            "SELECT key, value FROM versions WHERE key IN (%s)"
+            % ",".join("?" * len(keys)),
+            keys,
+        )
+        return dict(rows)
+
+    def version(self, key):
+        """Return the version of ``key``, starting it at now if it has none."""
+        conn = self._connection()
+        conn.execute(
+            "INSERT OR IGNORE INTO versions (key, value) VALUES (?, ?)",
+            (key, _now_us()),
+        )
+        return conn.execute(
+            "SELECT value FROM versions WHERE key = ?", (key,)
+        ).fetchone()[0]
+
+    def bump(self, key):
+        conn = self._connection()
+        conn.execute(
+            "INSERT INTO versions (key, value) VALUES (?, ?) ON CONFLICT(key) "
+            "DO UPDATE SET value = max(excluded.value, versions.value + 1)",
+            (key, _now_us()),
+        )
+        return conn.execute(
+            "SELECT value FROM versions WHERE key = ?", (key,)
+        ).fetchone()[0]
+
+
+class FragmentCache:
+    def __init__(self):
+        self.backend = None
+        # entities that were never bumped are as old as the cache
+        self.epoch = _now_us()
+
+    def init_app(self, app):
+        backend = app.config["FRAGMENT_CACHE_BACKEND"]
+        if backend == "sqlite":
+            self.backend = SQLiteBackend(
+                app.config["FRAGMENT_CACHE_PATH"], app.config["FRAGMENT_CACHE_SIZE"]
+            )
+        elif backend == "memory":
+            self.backend = MemoryBackend(app.config["FRAGMENT_CACHE_SIZE"])
+        else:
+            self.backend = None
+        if self.backend is not None:
+            # shared by the backend's processes, so their ETags agree
+            self.epoch = self.backend.version("epoch")
+        app.jinja_env.globals["fragment_cache"] = self.fragment
+
+    @staticmethod
+    def _version_key(kind, id):
+        return f"v:{kind}:{id}"
+
+    def versions(self, *entities):
+        if self.backend is None:
+            return tuple(self.epoch for _ in entities)
+        keys = [self._version_key(kind, id) for kind, id in entities]
+        found = self.backend.get_versions(keys)
+        return tuple(found.get(key, self.epoch) for key in keys)
+
+    def bump(self, kind, id):
+        if self.backend is not None:
+            return self.backend.bump(self._version_key(kind, id))
+
+    def fragment(self, name, *entities, vary=(), caller=None):
+        """Render ``caller`` once per version of ``entities``.
+
+        Used from templates as a call block::
+
+            {% call fragment_cache("comment", ("comment", c.id)) %}...{% endcall %}
+        """
+        if self.backend is None:
+            return caller()
+        parts = [name]
+        parts.extend(f"{kind}{id}" for kind, id in entities)
+        parts.extend(str(version) for version in self.versions(*entities))
+        parts.extend(str(value) for value in vary)
+        key = ":".join(parts)
+        html = self.backend.get(key)
+        if html is None:
+            html = str(caller())
+            self.backend.set(key, html)
+        return Markup(html)
+
+
+cache = FragmentCache()
@@ -0,0 +1,71 @@
+"""Append-only change log shared by the workers on one host.
+
+In-process indexes (see :mod:`app.followgraph`) write one line per change
+after the change is committed and replay the lines written by other workers
+before they answer. Once the file grows past ``max_size`` it is replaced by
+an empty one; readers notice the new inode and rebuild from the database,
+which already holds every change that was logged.
+"""
+import os
+
+
+class Changelog:
+    def __init__(self, path, max_size=4 * 1024 * 1024):
+        self.path = path
+        self.max_size = max_size
+        self.inode = None
+        self.offset = 0
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    def _stat(self):
+        try:
+            return os.stat(self.path)
+        except FileNotFoundError:
+            with open(self.path, "a"):
+                pass
+            return os.stat(self.path)
+
+    def mark(self):
+        """Start reading at the current end; call before rebuilding."""
+        stat = self._stat()
+        self.inode = stat.st_ino
+        self.offset = stat.st_size
+
+    def read(self):
+        """Return the entries written since the last call.
+
+        Returns None when the log was rotated, in which case the reader has
+        to rebuild its state and call :meth:`mark` again.
+        """
+        stat = self._stat()
+        if stat.st_ino != self.inode or stat.st_size < self.offset:
+            return None
+        if stat.st_size == self.offset:
+            return []
+        with open(self.path, "rb") as f:
+            f.seek(self.offset)
+            data = f.read(stat.st_size - self.offset)
+        # a line still being written is picked up next time
+        end = data.rfind(b"\n") + 1
+        self.offset += end
+        return [line.decode("utf-8").split(" ") for line in data[:end].splitlines()]
+
+    def append(self, *entries):
+        data = "".join(
+            " ".join(str(field) for field in entry) + "\n" for entry in entries
+        )
+        fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, data.encode("utf-8"))
+            size = os.fstat(fd).st_size
+        finally:
+            os.close(fd)
+        if size > self.max_size:
+            self.rotate()
+
+    def rotate(self):
+        """Make every reader, this one included, rebuild from scratch."""
+        tmp = f"{self.path}.{os.getpid()}"
+        with open(tmp, "w"):
+            pass
+        os.replace(tmp, self.path)
@@ -0,0 +1,82 @@
+"""Conditional GET for the main pages.
+
+A view calls :func:`not_modified` with the entities its page is built from
+before it runs any heavy query. The ETag is derived from their version stamps
+(see :mod:`app.cache`) and the viewer, Last-Modified from the newest stamp,
+so a matching ``If-None-Match``/``If-Modified-Since`` is answered with a 304
+without rendering anything.
+"""
+import hashlib
+import time
+from datetime import datetime
+
+from flask import current_app, g, request, session
+from flask_login import current_user
+
+from app.cache import cache
+
+# bumped whenever a username changes, since names show up on most pages
+NAMES = ("names", 0)
+# bumped by every write that changes what the post listings show
+FEED = ("feed", 0)
+
+
+def not_modified(*entities, extra=()):
+    """Return a 304 response if the client's copy is current, otherwise None."""
+    if request.method != "GET":
+        return None
+    versions = cache.versions(*entities)
+    parts = [
+        request.full_path,
+        current_user.get_id(),
+        getattr(current_user, "confirmed", None),
+        *versions,
+        *extra,
+    ]
+    etag = hashlib.sha1(repr(parts).encode("utf-8")).hexdigest()
+    # Last-Modified has whole seconds: round the newest stamp up, and leave
+    # the header out until that second is over, since a write later in the
+    # same second would get the same date and only the ETag tells them apart
+    modified = -(-max(versions) // 1000000)
+    if modified > time.time():
+        last_modified = None
+    else:
+        last_modified = datetime.utcfromtimestamp(modified)
+    g.validators = (etag, last_modified)
+
+    # pending flash messages are part of the page
+    if session.get("_flashes"):
+        return None
+    if request.if_none_match:
+        fresh = request.if_none_match.contains(etag)
+    else:
+        fresh = (
+            last_modified is not None
+            and request.if_modified_since is not None
+            and last_modified <= request.if_modified_since.replace(tzinfo=None)
+        )
+    if not fresh:
+        return None
+    response = current_app.response_class(status=304)
+    set_validators(response)
+    return response
+
+
+def csrf_window():
+    """Pages embedding a CSRF token must change before the token expires."""
+    if not current_app.config.get("WTF_CSRF_ENABLED", True):
+        return 0
+    limit = current_app.config.get("WTF_CSRF_TIME_LIMIT", 3600) or 3600
+    return int(datetime.utcnow().timestamp()) // (limit // 2)
+
+
+def set_validators(response):
+    validators = g.pop("validators", None)
+    if validators is None or response.status_code not in (200, 304):
+        return response
+    etag, last_modified = validators
+    response.set_etag(etag)
+    if last_modified is not None:
+        response.last_modified = last_modified
+    response.headers["Cache-Control"] = "private, no-cache"
+    return response
@@ -0,0 +1,149 @@
+"""Denormalized counts kept on the posts and users rows.
+
+Pages read ``posts.like_count``, ``posts.comment_count``,
+``users.post_count``, ``users.follower_count`` and
+``users.following_count`` instead of counting rows. Every write path
+adjusts them with an ``UPDATE ... SET n = n + delta`` in the transaction of
+the write, so a rolled back write leaves them alone. Soft-deleted posts
+and comments are not counted. ``flask counters reconcile`` repairs whatever
+drifted anyway, a chunk of rows per transaction; bulk loaders call
+:func:`recount`.
+"""
+import click
+from flask.cli import AppGroup
+from sqlalchemy import false, func, select, update
+
+from app import db
+from app.cache import cache
+from app.conditional import FEED
+from app.models import Comment, Follow, Like, Post, User
+
+# each counter, the column whose rows it counts and the conditions on them
+COUNTERS = {
+    "posts.like_count": (Post.like_count, Like.post_id, ()),
+    "posts.comment_count": (
+        Post.comment_count,
+        Comment.post_id,
+        (Comment.deleted == false(),),
+    ),
+    "users.post_count": (User.post_count, Post.user_id, (Post.deleted == false(),)),
+    "users.follower_count": (User.follower_count, Follow.followed_id, ()),
+    "users.following_count": (User.following_count, Follow.follower_id, ()),
+}
+# the fragment cache kind of each counter's rows
+KINDS = {Post: "post", User: "user"}
+
+counters_cli = AppGroup("counters", help="Maintain the denormalized counts.")
+
+
+def _actual(name):
+    counter, key, conditions = COUNTERS[name]
+    return (
+        select(func.count())
+        .where(key == counter.class_.id, *conditions)
+        .scalar_subquery()
+    )
+
+
+def _name(counter):
+    return f"{counter.class_.__tablename__}.{counter.key}"
+
+
+def adjust(counter, ids, delta):
+    """Add ``delta`` to ``counter`` on the rows with these ids."""
+    if not ids or not delta:
+        return
+    model = counter.class_
+    db.session.execute(
+        update(model)
+        .where(model.id.in_(ids))
+        .values({counter.key: counter + delta})
+        .execution_options(synchronize_session=False)
+    )
+
+
+def refresh(counter, ids):
+    """Count ``counter`` afresh on the rows with these ids (a list or select)."""
+    model = counter.class_
+    db.session.execute(
+        update(model)
+        .where(model.id.in_(ids))
+        .values({counter.key: _actual(_name(counter))})
+        .execution_options(synchronize_session=False)
+    )
+
+
+def follows_changed(follower_id, followed_ids, delta, rowcount):
+    """Count ``rowcount`` follows from ``follower_id`` added or removed.
+
+    ``delta`` is 1 or -1. When fewer rows changed than ids were given,
+    another request got there first, so the counts are taken afresh.
+    """
+    if rowcount == len(followed_ids):
+        adjust(User.follower_count, followed_ids, delta)
+        adjust(User.following_count, [follower_id], delta * rowcount)
+    else:
+        refresh(User.follower_count, followed_ids)
+        refresh(User.following_count, [follower_id])
+
+
+def recount():
+    """Recompute every counter, e.g. after rows were loaded in bulk."""
+    for name, (counter, _, _) in COUNTERS.items():
+        db.session.execute(
+            update(counter.class_)
+            .values({counter.key: _actual(name)})
+            .execution_options(synchronize_session=False)
+        )
+
+
+def reconcile(name, chunk_size=1000):
+    """Repair one counter ``chunk_size`` rows at a time; returns the fixes."""
+    counter = COUNTERS[name][0]
+    model = counter.class_
+    table = model.__table__
+    actual = _actual(name)
+    repaired = 0
+    after = 0
+    while True:
+        ids = (
+            db.session.execute(
+                select(table.c.id)
+                .where(table.c.id > after)
+                .order_by(table.c.id)
+                .limit(chunk_size)
+                .execution_options(include_deleted=True)
+            )
+            .scalars()
+            .all()
+        )
+        if not ids:
+            break
+        drifted = (
+            db.session.execute(
+                select(table.c.id)
+                .where(table.c.id.between(ids[0], ids[-1]), counter != actual)
+                .execution_options(include_deleted=True)
+            )
+            .scalars()
+            .all()
+        )
+        if drifted:
+            refresh(counter, drifted)
+        db.session.commit()
+        for id in drifted:
+            cache.bump(KINDS[model], id)
+        if drifted and model is Post:
+            cache.bump(*FEED)
+        repaired += len(drifted)
+        after = ids[-1]
+    return repaired
+
+
+@counters_cli.command("reconcile")
+@click.option("--chunk-size", default=1000, help="Rows checked per transaction.")
+@click.argument("names", nargs=-1, type=click.Choice(sorted(COUNTERS)))
+def reconcile_cli(chunk_size, names):
+    """Repair the counts that drifted from the rows they count (or just NAMES)."""
+    for name in names or sorted(COUNTERS):
+        click.echo(f"{name}: {reconcile(name, chunk_size)} rows repaired")
@@ -0,0 +1,235 @@
+"""Bulk export and import of the site's content as JSON lines.
+
+Every line is ``{"table": name, "row": {column: value}}``. Export streams
+each table through a server-side cursor, so memory does not grow with the
+table. Import inserts in chunks with one ``executemany`` each, or ``COPY``
+on PostgreSQL, inside a single transaction. Ids are kept, so the target
+tables should be empty; timelines are rebuilt from the imported follows
+afterwards.
+"""
+import gzip
+import io
+import json
+import sys
+from datetime import datetime
+
+import click
+from flask.cli import AppGroup
+from sqlalchemy import DateTime, text
+
+from app import db
+from app.availability import availability
+from app.cache import cache
+from app.conditional import FEED, NAMES
+from app.counters import recount
+from app.followgraph import follow_graph
+from app.timeline import rebuild
+
+data_cli = AppGroup("data", help="Import and export content.")
+
+# in dependency order, so rows are loaded after the rows they reference
+TABLES = ("users", "posts", "comments", "follows", "likes")
+
+
+def _open(path, mode):
+    if path == "-":
+        return sys.stdout if mode == "w" else sys.stdin
+    if path.endswith(".gz"):
+        return gzip.open(path, mode + "t", encoding="utf-8")
+    return open(path, mode, encoding="utf-8")
+
+
+def _encode(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"cannot serialize {type(value).__name__}")
+
+
+def export_rows(out, tables=TABLES, batch_size=5000):
+    counts = {}
+    with db.engine.connect() as connection:
+        connection = connection.execution_options(
+            stream_results=True, max_row_buffer=batch_size
+        )
+        for name in tables:
+            table = db.metadata.tables[name]
+            result = connection.execute(
+                table.select().order_by(*table.primary_key.columns)
+            )
+            count = 0
+            for rows in result.partitions(batch_size):
+                for row in rows:
+                    out.write(
+                        json.dumps(
+                            {"table": name, "row": dict(row._mapping)},
+                            default=_encode,
+                        )
+                    )
+                    out.write("\n")
+                count += len(rows)
+            counts[name] = count
+    return counts
+
+
+def _copy_value(value):
+    if value is None:
+        return r"\N"
+    if isinstance(value, bool):
+        return "t" if value else "f"
+    return (
+        str(value)
+        .replace("\\", "\\\\")
+        .replace("\t", "\\t")
+        .replace("\n", "\\n")
+        .replace("\r", "\\r")
+    )
+
+
+def _copy(table, rows):
+    # columns left out of the export keep their server defaults
+    columns = [column.name for column in table.columns if column.name in rows[0]]
+    buffer = io.StringIO()
+    for row in rows:
+        buffer.write("\t".join(_copy_value(row.get(name)) for name in columns))
+        buffer.write("\n")
+    buffer.seek(0)
+    cursor = db.session.connection().connection.cursor()
+    cursor.copy_expert(f"COPY {table.name} ({', '.join(columns)}) FROM STDIN", buffer)
+
+
+class Loader:
+    def __init__(self, chunk_size):
+        self.chunk_size = chunk_size
+        self.postgres = db.engine.dialect.name == "postgresql"
+        self.table = None
+        self.pending = []
+        self.counts = {}
+        self.dates = []
+
+    def add(self, name, row):
+        if name not in TABLES:
+            raise click.ClickException(f"unknown table {name!r}")
+        if self.table is None or name != self.table.name:
+            self.flush()
+            self.table = db.metadata.tables[name]
+            self.dates = [
+                column.name
+                for column in self.table.columns
+                if isinstance(column.type, DateTime)
+            ]
+        if not self.postgres:
+            for column in self.dates:
+                if row.get(column) is not None:
+                    row[column] = datetime.fromisoformat(row[column])
+        self.pending.append(row)
+        if len(self.pending) >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        if not self.pending:
+            return
+        if self.postgres:
+            _copy(self.table, self.pending)
+        else:
+            db.session.execute(self.table.insert(), self.pending)
+        name = self.table.name
+        self.counts[name] = self.counts.get(name, 0) + len(self.pending)
+        self.pending = []
+
+
+def _secondary_indexes(tables):
+    # non-unique indexes only check nothing, so they can be rebuilt afterwards
+    return [
+        index
+        for name in tables
+        for index in db.metadata.tables[name].indexes
+        if not index.unique
+    ]
+
+
+def _reset_sequences():
+    for name in TABLES:
+        table = db.metadata.tables[name]
+        if "id" in table.columns and table.c.id.autoincrement is not False:
+            db.session.execute(
+                text(
+                    f"SELECT setval(pg_get_serial_sequence('{name}', 'id'), "
+                    f"coalesce(max(id), 0) + 1, false) FROM {name}"
+                )
+            )
+
+
+def import_rows(lines, chunk_size=10000, rebuild_indexes=False):
+    """Load exported lines in one transaction and return the rows per table."""
+    loader = Loader(chunk_size)
+    indexes = _secondary_indexes(TABLES) if rebuild_indexes else []
+    connection = db.session.connection()
+    if not loader.postgres:
+        # SQLite checks foreign keys at commit instead of per row
+        db.session.execute(text("PRAGMA defer_foreign_keys = ON"))
+    try:
+        for index in indexes:
+            index.drop(bind=connection)
+        for line in lines:
+            if line.strip():
+                record = json.loads(line)
+                loader.add(record["table"], record["row"])
+        loader.flush()
+        for index in indexes:
+            index.create(bind=connection)
+        if loader.postgres:
+            _reset_sequences()
+        rebuild()
+        recount()
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    follow_graph.invalidate()
+    availability.invalidate()
+    cache.bump(*FEED)
+    cache.bump(*NAMES)
+    return loader.counts
+
+
+@data_cli.command("export")
+@click.argument("path", default="-")
+@click.option(
+    "--table",
+    "tables",
+    multiple=True,
+    type=click.Choice(TABLES),
+    help="Export only these tables (repeatable).",
+)
+@click.option("--batch-size", default=5000, help="Rows fetched per round trip.")
+def export_command(path, tables, batch_size):
+    """Write content as JSON lines to PATH (a .gz suffix compresses)."""
+    tables = [name for name in TABLES if not tables or name in tables]
+    out = _open(path, "w")
+    try:
+        counts = export_rows(out, tables, batch_size)
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    for name, count in counts.items():
+        click.echo(f"{name}: {count}", err=True)
+
+
+@data_cli.command("import")
+@click.argument("path", default="-")
+@click.option("--chunk-size", default=10000, help="Rows sent per statement.")
+@click.option(
+    "--rebuild-indexes",
+    is_flag=True,
+    help="Drop secondary indexes during the load and build them once at the end.",
+)
+def import_command(path, chunk_size, rebuild_indexes):
+    """Load JSON lines written by ``flask data export`` from PATH."""
+    lines = _open(path, "r")
+    try:
+        counts = import_rows(lines, chunk_size, rebuild_indexes)
+    finally:
+        if lines is not sys.stdin:
+            lines.close()
+    for name, count in counts.items():
+        click.echo(f"{name}: {count}", err=True)
@@ -0,0 +1,48 @@
+from sqlalchemy.orm import defer, joinedload
+
+from app import db
+from app.models import Like, Post
+from app.pagination import cached_total, paginate_request
+
+# cards show the excerpt; only the post page loads the full text
+CARD_OPTIONS = (
+    defer(Post.content, raiseload=True),
+    defer(Post.content_html, raiseload=True),
+)
+
+
+def load_feed(query, viewer, total_key=None, columns=None, per_page=4, total=None):
+    """Return one keyset page of a post query with everything a card displays.
+
+    The author is joined into the page query and the viewer's likes are
+    fetched for the whole page at once, so a page costs the same number of
+    queries no matter how many posts it shows. The post bodies are left in
+    the database. The total is ``total`` if given, otherwise a cached count
+    stored under ``total_key``.
+    """
+    if total is None:
+        total = cached_total(total_key, query)
+    posts = paginate_request(
+        query.options(joinedload(Post.author), *CARD_OPTIONS),
+        columns or (Post.date_posted, Post.id),
+        per_page=per_page,
+        total=total,
+        key=lambda post: (post.date_posted, post.id),
+    )
+    attach_feed_info(posts.items, viewer)
+    return posts
+
+
+def attach_feed_info(posts, viewer):
+    ids = [post.id for post in posts]
+    liked = set()
+    if ids and viewer.is_authenticated:
+        liked = {
+            post_id
+            for (post_id,) in db.session.query(Like.post_id).filter(
+                Like.user_id == viewer.id, Like.post_id.in_(ids)
+            )
+        }
+    for post in posts:
+        post.liked_by_viewer = post.id in liked
+    return posts
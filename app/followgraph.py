@@ -0,0 +1,167 @@
+"""In-memory index of the follows table.
+
+Each process keeps two sorted ``array("I")`` adjacency lists per user, one
+of the users it follows and one of its followers, so membership checks are
+a bisect and counts are a ``len``. The index is built from the table on
+first use and kept current from committed Follow inserts and deletes; other
+workers pick those up through a :class:`app.changelog.Changelog`. The log
+only reaches the workers on one host, so the index is also rebuilt every
+FOLLOW_GRAPH_TTL seconds to pick up follows written elsewhere.
+"""
+import os
+import threading
+import time
+from array import array
+from bisect import bisect_left
+
+from sqlalchemy import event, select
+from sqlalchemy.orm import Session, object_session
+
+from app import db
+from app.changelog import Changelog
+
+EMPTY = array("I")
+
+
+def _insert(lists, key, value):
+    values = lists.get(key)
+    if values is None:
+        lists[key] = array("I", (value,))
+        return
+    i = bisect_left(values, value)
+    if i == len(values) or values[i] != value:
+        values.insert(i, value)
+
+
+def _remove(lists, key, value):
+    values = lists.get(key)
+    if values is None:
+        return
+    i = bisect_left(values, value)
+    if i < len(values) and values[i] == value:
+        del values[i]
+        if not values:
+            del lists[key]
+
+
+class FollowGraph:
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.following = {}
+        self.followers = {}
+        self.log = None
+        self.ttl = None
+        self.pid = None
+        self.built = 0
+
+    def init_app(self, app):
+        self.log = Changelog(
+            app.config["FOLLOW_GRAPH_LOG"], app.config["FOLLOW_GRAPH_LOG_SIZE"]
+        )
+        self.ttl = app.config["FOLLOW_GRAPH_TTL"]
+        self.pid = None
+
+    def watch(self, model):
+        """Record the follows a commit inserts or deletes."""
+
+        def mark(sign):
+            def listener(mapper, connection, target):
+                self.stage(
+                    object_session(target),
+                    [(sign, target.follower_id, target.followed_id)],
+                )
+
+            return listener
+
+        event.listen(model, "after_insert", mark("+"))
+        event.listen(model, "after_delete", mark("-"))
+
+    def stage(self, session, changes):
+        """Publish ``("+" | "-", follower_id, followed_id)`` changes once
+        ``session`` commits; for follows written without the ORM."""
+        session.info.setdefault("follow_graph", []).extend(changes)
+
+    def _rebuild(self):
+        self.log.mark()
+        following = {}
+        followers = {}
+        follows = db.metadata.tables["follows"]
+        # from the primary: a lagging replica would miss follows logged
+        # before the mark, and those are never replayed
+        rows = db.session.execute(
+            select(follows.c.follower_id, follows.c.followed_id)
+            .order_by(follows.c.follower_id, follows.c.followed_id)
+            .execution_options(use_primary=True)
+        )
+        for follower_id, followed_id in rows:
+            following.setdefault(follower_id, array("I")).append(followed_id)
+            followers.setdefault(followed_id, array("I")).append(follower_id)
+        for user_id, values in followers.items():
+            followers[user_id] = array("I", sorted(values))
+        self.following = following
+        self.followers = followers
+        self.pid = os.getpid()
+        self.built = time.monotonic()
+
+    def _apply(self, sign, follower_id, followed_id):
+        if sign == "+":
+            _insert(self.following, follower_id, followed_id)
+            _insert(self.followers, followed_id, follower_id)
+        else:
+            _remove(self.following, follower_id, followed_id)
+            _remove(self.followers, followed_id, follower_id)
+
+    def _sync(self):
+        with self.lock:
+            expired = self.ttl and time.monotonic() - self.built > self.ttl
+            if self.pid != os.getpid() or expired:
+                self._rebuild()
+                return
+            entries = self.log.read()
+            if entries is None:
+                self._rebuild()
+                return
+            for sign, follower_id, followed_id in entries:
+                self._apply(sign, int(follower_id), int(followed_id))
+
+    def is_following(self, follower_id, followed_id):
+        if follower_id is None or followed_id is None:
+            return False
+        self._sync()
+        values = self.following.get(follower_id, EMPTY)
+        i = bisect_left(values, followed_id)
+        return i < len(values) and values[i] == followed_id
+
+    def following_count(self, user_id):
+        self._sync()
+        return len(self.following.get(user_id, EMPTY))
+
+    def followers_count(self, user_id):
+        self._sync()
+        return len(self.followers.get(user_id, EMPTY))
+
+    def followed_ids(self, user_id):
+        self._sync()
+        return list(self.following.get(user_id, EMPTY))
+
+    def publish(self, changes):
+        """Log committed changes; each process applies them on its next lookup."""
+        if changes:
+            self.log.append(*changes)
+
+    def invalidate(self):
+        """Rebuild everywhere, e.g. after follows were written in bulk."""
+        self.log.rotate()
+
+
+follow_graph = FollowGraph()
+
+
+@event.listens_for(Session, "after_commit")
+def _publish_committed(session):
+    follow_graph.publish(session.info.pop("follow_graph", None))
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def _forget_rolled_back(session, previous_transaction):
+    session.info.pop("follow_graph", None)
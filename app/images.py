@@ -0,0 +1,85 @@
+"""Profile picture processing.
+
+Uploads are stored under the hash of their content, so the same picture
+uploaded twice is processed and stored once. The image is decoded a single
+time (JPEGs at reduced scale through ``draft``) and every size is cut from
+that one buffer, largest first, in a process pool so the request does not
+wait for it. Until the files exist :func:`picture_url` serves the default
+picture.
+"""
+import hashlib
+import io
+import logging
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from flask import current_app, url_for
+from PIL import Image
+
+PROFILE_SIZES = {"profile_pics": (125, 111), "small_profile_pics": (70, 61)}
+
+logger = logging.getLogger(__name__)
+_executor = None
+_executor_pid = None
+
+
+def render_thumbnails(data, targets):
+    """Write ``data`` scaled down to every ``(path, size)`` in ``targets``."""
+    targets = sorted(targets, key=lambda target: target[1], reverse=True)
+    with Image.open(io.BytesIO(data)) as image:
+        fmt = image.format
+        if fmt == "JPEG":
+            image.draft("RGB", targets[0][1])
+        image.load()
+        for path, size in targets:
+            image.thumbnail(size)
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            image.save(tmp_path, format=fmt)
+            os.replace(tmp_path, path)
+
+
+def _pool():
+    global _executor, _executor_pid
+    if _executor is None or _executor_pid != os.getpid():
+        _executor = ProcessPoolExecutor(
+            max_workers=current_app.config["IMAGE_WORKERS"],
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+        _executor_pid = os.getpid()
+    return _executor
+
+
+def _log_failure(future):
+    if future.exception() is not None:
+        # the user simply keeps the default picture
+        logger.error("Profile picture processing failed: %r", future.exception())
+
+
+def picture_path(folder, name):
+    return os.path.join(current_app.root_path, "static", folder, name)
+
+
+def save_profile_picture(upload):
+    data = upload.read()
+    _, ext = os.path.splitext(upload.filename)
+    name = hashlib.sha256(data).hexdigest()[:32] + ext.lower()
+    targets = [
+        (picture_path(folder, name), size)
+        for folder, size in PROFILE_SIZES.items()
+        if not os.path.exists(picture_path(folder, name))
+    ]
+    if targets:
+        if current_app.config["IMAGE_WORKERS"]:
+            _pool().submit(render_thumbnails, data, targets).add_done_callback(
+                _log_failure
+            )
+        else:
+            render_thumbnails(data, targets)
+    return name
+
+
+def picture_url(name, folder="profile_pics"):
+    if not name or not os.path.exists(picture_path(folder, name)):
+        name = "default.jpg"
+    return url_for("static", filename=f"{folder}/{name}")
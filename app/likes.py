@@ -0,0 +1,40 @@
+"""Likes and the ``posts.like_count`` counter they maintain.
+
+Liking is one ``INSERT ... ON CONFLICT DO NOTHING`` and unliking one
+``DELETE``; the counter is only touched when that statement changed a row,
+in the same transaction, so repeated or concurrent requests cannot skew it.
+"""
+from app import db
+from app.counters import adjust
+from app.models import Like, Post
+from app.sql import insert_ignore
+
+
+def like_count(post_id):
+    return db.session.query(Post.like_count).filter(Post.id == post_id).scalar()
+
+
+def like(user_id, post_id):
+    """Like a post; returns the new count, or None if there is no such post."""
+    if like_count(post_id) is None:
+        return None
+    result = db.session.execute(
+        insert_ignore(Like.__table__).values(user_id=user_id, post_id=post_id)
+    )
+    if result.rowcount:
+        adjust(Post.like_count, [post_id], 1)
+    count = like_count(post_id)
+    db.session.commit()
+    return count
+
+
+def unlike(user_id, post_id):
+    """Remove a like; returns the new count, or None if there is no such post."""
+    result = db.session.execute(
+        Like.__table__.delete().where(Like.user_id == user_id, Like.post_id == post_id)
+    )
+    if result.rowcount:
+        adjust(Post.like_count, [post_id], -1)
+    count = like_count(post_id)
+    db.session.commit()
+    return count
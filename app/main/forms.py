@@ -12,3 +12,7 @@ class PostForm(FlaskForm):
 class CommentForm(FlaskForm):
     body = TextAreaField("Add Comment", validators=[DataRequired()])
     submit = SubmitField("Submit")
+
+
+class DeleteForm(FlaskForm):
+    submit = SubmitField("Delete")
@@ -1,12 +1,19 @@
-from flask import (Blueprint, abort, current_app, flash, jsonify, redirect,
-                   render_template, request, url_for)
+from flask import (Blueprint, abort, flash, jsonify, redirect, render_template,
+                   request, url_for)
 from flask_login import current_user
 from flask_login.utils import login_required
-from flask_sqlalchemy import get_debug_queries
 
-from app import db
-from app.main.forms import CommentForm, PostForm
-from app.models import Comment, Follow, Like, Post, User
+from app import counters, db, likes, purge
+from app.cache import cache
+from app.conditional import (FEED, NAMES, csrf_window, not_modified,
+                             set_validators)
+from app.feed import load_feed
+from app.main.forms import CommentForm, DeleteForm, PostForm
+from app.models import Comment, Post, User
+from app.pagination import invalidate_totals, paginate_request
+from app.search import DOCUMENTS, search_page
+from app.timeline import fan_out, timeline_query
+from app.usercache import user_cache
 
 main = Blueprint("main", __name__)
 
@@ -18,48 +25,45 @@ def home():
     if not current_user.confirmed:
         return render_template("unconfirmed.html")
     else:
-
-        page = request.args.get("page", 1, type=int)
-        posts = Post.query.order_by(Post.date_posted.desc()).paginate(
-            page=page, per_page=4
-        )
-        return render_template("home.html", posts=posts, Like=Like)
+        cached = not_modified(FEED, extra=(csrf_window(),))
+        if cached:
+            return cached
+        posts = load_feed(Post.query, current_user, "posts")
+        return render_template("home.html", posts=posts, form=DeleteForm())
 
 
 @main.route("/post/<int:id>", methods=["POST", "GET"])
 @login_required
 def post(id):
-    post = Post.query.filter_by(id=id).first()
+    cached = not_modified(("post", id), NAMES, extra=(csrf_window(),))
+    if cached:
+        return cached
+    post = Post.query.filter_by(id=id).first_or_404()
     user = User.query.filter_by(id=post.user_id).first()
     form = CommentForm()
-    comments = (
-        Comment.query.filter_by(post_id=post.id)
-        .order_by(Comment.timestamp.desc())
-        .all()
-    )
-    page = request.args.get("page", 1, type=int)
-    pagin = Comment.query.filter_by(post_id=post.id).paginate(page=page, per_page=4)
     if form.validate_on_submit():  # adding comments
         comment = Comment(
             body=form.body.data, post=post, author=current_user._get_current_object()
         )
         db.session.add(comment)
+        counters.adjust(Post.comment_count, [post.id], 1)
         db.session.commit()
+        cache.bump("post", post.id)
         flash("New comment added", "success")
-        if (
-            pagin.total % 4 + 1 == 1
-        ):  # code that will redirect user to a last comment's page after posting a comment
-            pages_num = pagin.pages + 1
-        else:
-            pages_num = pagin.pages
-        return redirect(url_for(".post", id=post.id, page=pages_num))
+        # redirect the user to the last comment's page after posting a comment
+        return redirect(url_for(".post", id=post.id, last=1))
+    comments = Comment.query.filter_by(post_id=post.id)
+    pagin = paginate_request(
+        comments,
+        (Comment.timestamp, Comment.id),
+        ascending=True,
+        total=post.comment_count,
+    )
     return render_template(
         "post.html",
         post=post,
         user=user,
         form=form,
-        comments=comments,
-        page=page,
         pagin=pagin,
     )
 
@@ -76,31 +80,44 @@ def newpost():
                 title=form.title.data, content=form.content.data, author=current_user
             )
             db.session.add(post)
+            db.session.flush()
+            fan_out(post)
+            counters.adjust(User.post_count, [post.user_id], 1)
             db.session.commit()
+            cache.bump(*FEED)
+            cache.bump("posts-by", post.user_id)
+            invalidate_totals("posts", "following:")
             flash("New post added", "success")
             return redirect(url_for(".home"))
     return render_template("new_post.html", form=form)
 
 
-@main.route("/delete_post/<int:id>", methods=["POST", "GET"])
+@main.route("/delete_post/<int:id>", methods=["POST"])
 @login_required
 def delete_post(id):
-
-    f = Post.query.filter_by(id=id).first()
-    db.session.delete(f)
-    db.session.commit()
-    page = request.args.get("page", 1, type=int)
-    posts = Post.query.order_by(Post.date_posted.desc()).paginate(page=page, per_page=4)
+    post = Post.query.filter_by(id=id).first_or_404()
+    if post.user_id != current_user.id and not current_user.has_role(2):
+        abort(403)
+    if not DeleteForm().validate_on_submit():
+        abort(400)
+    purge.delete_post(post)
     flash("Post deleted", "success")
-    return render_template("home.html", posts=posts, Like=Like)
+    return redirect(url_for(".home"))
 
 
-@main.route("/delete_comment/<int:id>/<int:post_id>", methods=["POST", "GET"])
+@main.route("/delete_comment/<int:id>/<int:post_id>", methods=["POST"])
 @login_required
 def delete_comment(id, post_id):
-    f = Comment.query.filter_by(id=id).first()
-    db.session.delete(f)
-    db.session.commit()
+    comment = Comment.query.filter_by(id=id).first_or_404()
+    if (
+        comment.author_id != current_user.id
+        and comment.post.user_id != current_user.id
+        and not current_user.has_role(2)
+    ):
+        abort(403)
+    if not DeleteForm().validate_on_submit():
+        abort(400)
+    purge.delete_comment(comment)
     flash("Comment deleted", "success")
 
     return redirect(url_for(".post", id=post_id))
@@ -109,12 +126,15 @@ def delete_comment(id, post_id):
 @main.route("/edit_post/<int:id>", methods=["POST", "GET"])
 @login_required
 def edit_post(id):
-    post = Post.query.filter_by(id=id).first()
+    post = Post.query.filter_by(id=id).first_or_404()
     form = PostForm()
     if form.validate_on_submit():
         post.title = form.title.data
         post.content = form.content.data
         db.session.commit()
+        cache.bump("post", post.id)
+        cache.bump(*FEED)
+        cache.bump("posts-by", post.user_id)
         flash("Post updated successfully", "success")
         return redirect(url_for("main.home"))
     form.title.data = post.title
@@ -133,49 +153,119 @@ def following(id):
     if not current_user.confirmed:
         return render_template("unconfirmed.html")
     else:
+        cached = not_modified(FEED, ("graph", id))
+        if cached:
+            return cached
         user = User.query.filter_by(id=id).first()
-        page = request.args.get("page", 1, type=int)
-        posts = (
-            Post.query.join(Follow, Follow.followed_id == Post.user_id)
-            .filter(Follow.follower_id == user.id)
-            .paginate(page=page, per_page=4)
-        )
-        return render_template("following.html", posts=posts, page=page)
+        query, columns = timeline_query(user.id)
+        posts = load_feed(query, current_user, f"following:{user.id}", columns)
+        return render_template("following.html", posts=posts, user=user)
+
+
+def _toggle_like(id, liked):
+    if liked:
+        count = likes.like(current_user.id, id)
+    else:
+        count = likes.unlike(current_user.id, id)
+    if count is None:
+        abort(404)
+    cache.bump("post", id)
+    cache.bump(*FEED)
+    return count
+
+
+@main.route("/api/like/<int:id>", methods=["POST"])
+@login_required
+def api_like(id):
+    # custom headers cannot be sent cross-site without CORS, which keeps
+    # other sites from liking on a user's behalf
+    if request.headers.get("X-Requested-With") != "XMLHttpRequest":
+        abort(400)
+    return jsonify(post_id=id, liked=True, like_count=_toggle_like(id, True))
+
+
+@main.route("/api/unlike/<int:id>", methods=["POST"])
+@login_required
+def api_unlike(id):
+    if request.headers.get("X-Requested-With") != "XMLHttpRequest":
+        abort(400)
+    return jsonify(post_id=id, liked=False, like_count=_toggle_like(id, False))
 
 
 @main.route("/like/<int:id>", methods=["POST", "GET"])
 @login_required
 def like(id):
-    page = request.args.get("page", 1, type=int)
-    posts = Post.query.order_by(Post.date_posted.desc()).paginate(page=page, per_page=4)
-    f = current_user.likes.filter_by(post_id=id).first()
-    if not f:
-        like = Like(user_id=current_user.id, post_id=id)
-        db.session.add(like)
-        db.session.commit()
-        return redirect(url_for(".home"))
+    _toggle_like(id, True)
+    return redirect(request.referrer or url_for(".home"))
 
 
 @main.route("/unlike/<int:id>", methods=["POST", "GET"])
 @login_required
 def unlike(id):
-    page = request.args.get("page", 1, type=int)
-    posts = Post.query.order_by(Post.date_posted.desc()).paginate(page=page, per_page=4)
-    post = Post.query.filter_by(id=id).first()
-    f = current_user.likes.filter_by(post_id=post.id).first()
-    if f:
-        db.session.delete(f)
-        db.session.commit()
-    return render_template("home.html", posts=posts, Like=Like)
+    _toggle_like(id, False)
+    return redirect(request.referrer or url_for(".home"))
 
 
-@main.after_app_request
-def after_request(response):
-    for query in get_debug_queries():
-        if query.duration >= current_app.config["FLASK_SLOW_DB_QUERY_TIME"]:
-            current_app.logger.warning(
-                "Slow query: {}\nParameters: {}\n Duration: {}\n Context: {}\n".format(
-                    query.statement, query.parameters, query.duration, query.context
-                )
+def _search_args():
+    q = request.args.get("q", "").strip()
+    kind = request.args.get("type", "posts")
+    if kind not in DOCUMENTS:
+        abort(400)
+    return q, kind
+
+
+@main.route("/search")
+@login_required
+def search():
+    q, kind = _search_args()
+    results = search_page(kind, q) if q else None
+    return render_template("search.html", q=q, kind=kind, results=results)
+
+
+@main.route("/api/search")
+@login_required
+def api_search():
+    q, kind = _search_args()
+    results = search_page(kind, q)
+    items = []
+    for row in results.items:
+        item = row[0]
+        if kind == "posts":
+            items.append(
+                {
+                    "id": item.id,
+                    "title": item.title,
+                    "excerpt": item.excerpt,
+                    "author": item.author.username,
+                    "date_posted": item.date_posted.isoformat(),
+                    "url": url_for(".post", id=item.id),
+                    "rank": row.rank,
+                }
             )
-    return response
+        else:
+            items.append(
+                {
+                    "id": item.id,
+                    "body": item.body,
+                    "author": item.author.username,
+                    "timestamp": item.timestamp.isoformat(),
+                    "post_id": item.post_id,
+                    "post_title": item.post.title,
+                    "url": url_for(".post", id=item.post_id),
+                    "rank": row.rank,
+                }
+            )
+    return jsonify(results=items, next=results.next_cursor, prev=results.prev_cursor)
+
+
+@main.route("/stats/user_cache")
+@login_required
+def user_cache_stats():
+    if not current_user.is_administrator():
+        abort(403)
+    return jsonify(user_cache.stats())
+
+
+@main.after_app_request
+def add_validators(response):
+    return set_validators(response)
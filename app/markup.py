@@ -0,0 +1,134 @@
+"""Markdown for posts and comments, rendered when it is written.
+
+Setting ``Post.content`` or ``Comment.body`` renders the Markdown, keeps
+only the tags in ALLOWED_TAGS, links bare URLs and stores the result in
+``content_html``/``body_html``, so pages emit stored HTML and never run
+Markdown or bleach while rendering. Posts also get a plain-text ``excerpt``
+of at most EXCERPT_LENGTH characters, which list pages show instead of
+loading the full text.
+
+Rows written before these columns existed, or by bulk inserts that bypass
+the ORM, are filled in by ``flask markup backfill``; until then the post
+page falls back to the plain text and list cards show no excerpt.
+"""
+import bleach
+import click
+from flask.cli import AppGroup
+from markdown import markdown
+from markupsafe import Markup
+from sqlalchemy import event, or_, select
+
+from app import db
+from app.cache import cache
+
+ALLOWED_TAGS = [
+    "a",
+    "abbr",
+    "acronym",
+    "b",
+    "blockquote",
+    "code",
+    "em",
+    "i",
+    "li",
+    "ol",
+    "pre",
+    "strong",
+    "ul",
+    "h1",
+    "h2",
+    "h3",
+    "p",
+]
+EXCERPT_LENGTH = 280
+# the Markdown column of each table, the columns its HTML and excerpt go to
+# and the fragment cache kind of its rows
+FIELDS = {
+    "posts": ("content", "content_html", "excerpt", "post"),
+    "comments": ("body", "body_html", None, "comment"),
+}
+
+markup_cli = AppGroup("markup", help="Maintain the rendered HTML of posts.")
+
+
+def render(text):
+    if text is None:
+        return None
+    html = markdown(text, output_format="html")
+    return bleach.linkify(bleach.clean(html, tags=ALLOWED_TAGS, strip=True))
+
+
+def excerpt(html, length=EXCERPT_LENGTH):
+    """Return the start of rendered HTML as plain text, cut at a word."""
+    if html is None:
+        return None
+    text = Markup(html).striptags()
+    if len(text) <= length:
+        return text
+    cut = text[: length - 1]
+    if " " in cut:
+        cut = cut.rsplit(" ", 1)[0]
+    return cut.rstrip() + "\u2026"
+
+
+def watch(attribute, target_name, excerpt_name=None):
+    """Render ``attribute`` into ``target_name`` whenever it is set."""
+
+    def on_set(target, value, oldvalue, initiator):
+        html = render(value)
+        setattr(target, target_name, html)
+        if excerpt_name is not None:
+            setattr(target, excerpt_name, excerpt(html))
+
+    event.listen(attribute, "set", on_set)
+
+
+def backfill(name, chunk_size=1000, everything=False):
+    """Render the rows without HTML (or all of them); returns the row count."""
+    source, target, summary, kind = FIELDS[name]
+    table = db.metadata.tables[name]
+    missing = [table.c[target].is_(None)]
+    if summary is not None:
+        missing.append(table.c[summary].is_(None))
+    rendered = 0
+    after = 0
+    while True:
+        query = (
+            select(table.c.id, table.c[source])
+            .where(table.c.id > after)
+            .order_by(table.c.id)
+            .limit(chunk_size)
+            .execution_options(include_deleted=True)
+        )
+        if not everything:
+            query = query.where(or_(*missing))
+        rows = db.session.execute(query).all()
+        if not rows:
+            break
+        values = {target: db.bindparam("html")}
+        if summary is not None:
+            values[summary] = db.bindparam("summary")
+        params = []
+        for row in rows:
+            html = render(row[1])
+            params.append({"row_id": row.id, "html": html, "summary": excerpt(html)})
+        db.session.execute(
+            table.update().where(table.c.id == db.bindparam("row_id")).values(values),
+            params,
+        )
+        db.session.commit()
+        for row in rows:
+            cache.bump(kind, row.id)
+        rendered += len(rows)
+        after = rows[-1].id
+    return rendered
+
+
+@markup_cli.command("backfill")
+@click.option("--chunk-size", default=1000, help="Rows rendered per transaction.")
+@click.option("--all", "everything", is_flag=True, help="Re-render every row.")
+@click.argument("names", nargs=-1, type=click.Choice(sorted(FIELDS)))
+def backfill_cli(chunk_size, everything, names):
+    """Store rendered HTML and excerpts for posts and comments (or just NAMES)."""
+    for name in names or sorted(FIELDS, reverse=True):
+        click.echo(f"{name}: {backfill(name, chunk_size, everything)} rows rendered")
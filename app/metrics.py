@@ -0,0 +1,202 @@
+"""Per-endpoint request and query metrics in the Prometheus text format.
+
+Statements are timed with engine events, so nothing is kept per query beyond
+a counter of statement shapes for the current request. That counter feeds
+the N+1 detector: a shape repeated METRICS_N_PLUS_ONE_THRESHOLD times or more
+within one request is logged and counted. Metrics are kept per process, so
+every worker reports its own series under a ``pid`` label.
+
+``/metrics`` answers only requests bearing ``Bearer <METRICS_TOKEN>``; with
+no token configured it is not served at all.
+"""
+import hmac
+import os
+import re
+import threading
+import time
+from collections import Counter, defaultdict
+
+from flask import Response, abort, current_app, g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Mapper
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+_literals = re.compile(r"\b\d+\b|'[^']*'")
+_in_lists = re.compile(
+    r"\((?:\s*\?\s*,)+\s*\?\s*\)|\((?:\s*%\(\w+\)s\s*,)+\s*%\(\w+\)s\s*\)"
+)
+
+
+def statement_shape(statement):
+    shape = _in_lists.sub("(?)", statement)
+    return " ".join(_literals.sub("?", shape).split())
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.total = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+        self.total += 1
+        self.sum += value
+
+    def lines(self, name, labels):
+        for bound, count in zip(self.buckets, self.counts):
+            yield f'{name}_bucket{{{labels},le="{bound}"}} {count}'
+        yield f'{name}_bucket{{{labels},le="+Inf"}} {self.total}'
+        yield f"{name}_sum{{{labels}}} {self.sum}"
+        yield f"{name}_count{{{labels}}} {self.total}"
+
+
+class Metrics:
+    histograms = {
+        "blog_request_duration_seconds": ("Request latency.", LATENCY_BUCKETS),
+        "blog_request_queries": ("SQL statements per request.", COUNT_BUCKETS),
+        "blog_request_query_seconds": (
+            "Time spent in SQL per request.",
+            LATENCY_BUCKETS,
+        ),
+        "blog_request_rows": ("ORM rows loaded per request.", COUNT_BUCKETS),
+        "blog_request_pool_wait_seconds": (
+            "Time spent waiting for a pooled connection per request.",
+            LATENCY_BUCKETS,
+        ),
+    }
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.series = defaultdict(dict)
+        self.n_plus_one = Counter()
+        self.collectors = []
+
+    def init_app(self, app):
+        app.before_request(self._start)
+        app.after_request(self._finish)
+        app.add_url_rule("/metrics", "metrics", self.view)
+        if not event.contains(Engine, "after_cursor_execute", _after_cursor_execute):
+            event.listen(Engine, "before_cursor_execute", _before_cursor_execute)
+            event.listen(Engine, "after_cursor_execute", _after_cursor_execute)
+            event.listen(Mapper, "load", _loaded)
+
+    def register_collector(self, collector):
+        """Add a callable returning extra ``(name, type, help, samples)`` tuples."""
+        self.collectors.append(collector)
+
+    def _start(self):
+        g.metrics = {
+            "start": time.perf_counter(),
+            "queries": 0,
+            "query_time": 0.0,
+            "rows": 0,
+            "pool_wait": 0.0,
+            "shapes": Counter(),
+        }
+
+    def _finish(self, response):
+        stats = g.pop("metrics", None)
+        if stats is None:
+            return response
+        endpoint = request.endpoint or "unmatched"
+        observed = {
+            "blog_request_duration_seconds": time.perf_counter() - stats["start"],
+            "blog_request_queries": stats["queries"],
+            "blog_request_query_seconds": stats["query_time"],
+            "blog_request_rows": stats["rows"],
+            "blog_request_pool_wait_seconds": stats["pool_wait"],
+        }
+        threshold = current_app.config["METRICS_N_PLUS_ONE_THRESHOLD"]
+        repeated = [
+            (shape, n) for shape, n in stats["shapes"].items() if n >= threshold
+        ]
+        with self.lock:
+            for name, value in observed.items():
+                series = self.series[name]
+                if endpoint not in series:
+                    series[endpoint] = Histogram(self.histograms[name][1])
+                series[endpoint].observe(value)
+            if repeated:
+                self.n_plus_one[endpoint] += 1
+        for shape, n in repeated:
+            current_app.logger.warning(
+                "Possible N+1 in %s: statement ran %d times: %s", endpoint, n, shape
+            )
+        g.request_stats = observed
+        return response
+
+    def render(self):
+        pid = os.getpid()
+        lines = []
+        with self.lock:
+            for name, (help, _) in self.histograms.items():
+                lines.append(f"# HELP {name} {help}")
+                lines.append(f"# TYPE {name} histogram")
+                for endpoint, histogram in sorted(self.series[name].items()):
+                    labels = f'endpoint="{endpoint}",pid="{pid}"'
+                    lines.extend(histogram.lines(name, labels))
+            lines.append(
+                "# HELP blog_n_plus_one_total Requests that repeated a statement shape."
+            )
+            lines.append("# TYPE blog_n_plus_one_total counter")
+            for endpoint, count in sorted(self.n_plus_one.items()):
+                lines.append(
+                    f'blog_n_plus_one_total{{endpoint="{endpoint}",pid="{pid}"}} {count}'
+                )
+        for collector in self.collectors:
+            for name, kind, help, samples in collector():
+                lines.append(f"# HELP {name} {help}")
+                lines.append(f"# TYPE {name} {kind}")
+                for labels, value in samples:
+                    labels = dict(labels, pid=pid)
+                    label_text = ",".join(f'{k}="{v}"' for k, v in labels.items())
+                    lines.append(f"{name}{{{label_text}}} {value}")
+        return "\n".join(lines) + "\n"
+
+    def view(self):
+        token = current_app.config["METRICS_TOKEN"]
+        if not token:
+            abort(404)
+        given = request.headers.get("Authorization", "")
+        if not hmac.compare_digest(given.encode(), f"Bearer {token}".encode()):
+            abort(403)
+        return Response(self.render(), mimetype="text/plain; version=0.0.4")
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    duration = time.perf_counter() - conn.info["query_start"].pop()
+    if not has_request_context():
+        return
+    stats = g.get("metrics")
+    if stats is None:
+        return
+    stats["queries"] += 1
+    stats["query_time"] += duration
+    stats["shapes"][statement_shape(statement)] += 1
+    if duration >= current_app.config["FLASK_SLOW_DB_QUERY_TIME"]:
+        current_app.logger.warning(
+            "Slow query: {}\nParameters: {}\n Duration: {}\n Context: {}\n".format(
+                statement, parameters, duration, request.endpoint
+            )
+        )
+
+
+def _loaded(target, context):
+    if has_request_context():
+        stats = g.get("metrics")
+        if stats is not None:
+            stats["rows"] += 1
+
+
+metrics = Metrics()
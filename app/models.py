@@ -8,12 +8,17 @@ from flask_login import AnonymousUserMixin, UserMixin, current_user
 from itsdangerous import TimedJSONWebSignatureSerializer as Serializer
 from sqlalchemy.orm import backref
 
-from app import db, login_manager
+from app import db, login_manager, markup
+from app.availability import availability
+from app.cache import cache
+from app.followgraph import follow_graph
+from app.softdelete import SoftDeleteMixin
+from app.usercache import user_cache
 
 
 @login_manager.user_loader
 def load_user(id):
-    return User.query.get(int(id))
+    return user_cache.get(User, int(id))
 
 
 class Follow(db.Model):
@@ -21,38 +26,74 @@ class Follow(db.Model):
     follower_id = db.Column(db.Integer, db.ForeignKey("users.id"), primary_key=True)
     followed_id = db.Column(db.Integer, db.ForeignKey("users.id"), primary_key=True)
     timestamp = db.Column(db.DateTime, default=datetime.utcnow)
+    __table_args__ = (db.Index("ix_follows_followed_id", "followed_id"),)
 
 
-class Comment(db.Model):
+follow_graph.watch(Follow)
+
+
+class TimelineEntry(db.Model):
+    __tablename__ = "timeline_entries"
+    user_id = db.Column(db.Integer, db.ForeignKey("users.id"), primary_key=True)
+    date_posted = db.Column(db.DateTime, primary_key=True)
+    post_id = db.Column(db.Integer, db.ForeignKey("posts.id"), primary_key=True)
+    author_id = db.Column(db.Integer, db.ForeignKey("users.id"))
+    __table_args__ = (
+        db.Index("ix_timeline_entries_user_id_author_id", "user_id", "author_id"),
+        db.Index("ix_timeline_entries_post_id", "post_id"),
+    )
+
+
+class Comment(SoftDeleteMixin, db.Model):
     __tablename__ = "comments"
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     body = db.Column(db.Text)
+    body_html = db.Column(db.Text)
     timestamp = db.Column(db.DateTime, default=datetime.utcnow)
     disabled = db.Column(db.Boolean)
     author_id = db.Column(db.Integer, db.ForeignKey("users.id"))
     post_id = db.Column(db.Integer, db.ForeignKey("posts.id"))
+    __table_args__ = (
+        db.Index("ix_comments_post_id_timestamp_id", "post_id", "timestamp", "id"),
+        db.Index("ix_comments_author_id", "author_id"),
+    )
 
     def __repr__(self):
         return f"<Comment '{self.id}')>'"
 
 
+markup.watch(Comment.body, "body_html")
+
+
 class Like(db.Model):
     __tablename__ = "likes"
     user_id = db.Column(db.Integer, db.ForeignKey("users.id"), primary_key=True)
     post_id = db.Column(db.Integer, db.ForeignKey("posts.id"), primary_key=True)
+    __table_args__ = (db.Index("ix_likes_post_id", "post_id"),)
 
 
-class User(db.Model, UserMixin):
+class User(SoftDeleteMixin, db.Model, UserMixin):
     __tablename__ = "users"
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
-    username = db.Column(db.String(25), nullable=False)
-    email = db.Column(db.String(35), nullable=False)
+    username = db.Column(db.String(25), nullable=False, index=True)
+    email = db.Column(db.String(35), nullable=False, index=True)
     password = db.Column(db.String(130), nullable=False)
     about_me = db.Column(db.Text(), nullable=True)
     picture = db.Column(db.String(50))
     member_since = db.Column(db.DateTime, default=datetime.utcnow)
     confirmed = db.Column(db.Boolean, default=False)
     role_id = db.Column(db.Integer, db.ForeignKey("roles.id"))
+    post_count = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+    follower_count = db.Column(
+        db.Integer, nullable=False, default=0, server_default="0"
+    )
+    following_count = db.Column(
+        db.Integer, nullable=False, default=0, server_default="0"
+    )
+    # see app.timeline
+    timeline_pull = db.Column(
+        db.Boolean, nullable=False, default=False, server_default=db.false()
+    )
     posts = db.relationship("Post", backref="author", lazy=True)
     follower = db.relationship(
         "Follow",
@@ -123,26 +164,99 @@ class User(db.Model, UserMixin):
         return self.role_id == 3
 
     def follow(self, user):
-        if not self.is_following(user):
-            f = Follow(follower=self, followed=user)
-            db.session.add(f)
-            db.session.commit()
+        # an insert that ignores an existing row: the graph may be stale
+        self.update_follows([user.id])
 
     def unfollow(self, user):
+        from app.counters import follows_changed
+        from app.timeline import prune
+
         f = self.follower.filter_by(followed_id=user.id).first()
         if f:
             db.session.delete(f)
+            follows_changed(self.id, [user.id], -1, 1)
+            prune(self.id, user.id)
             db.session.commit()
+            cache.bump("graph", self.id)
+            cache.bump("graph", user.id)
+
+    def update_follows(self, follow_ids=(), unfollow_ids=()):
+        """Follow and unfollow many users in one transaction.
+
+        New follows go in as one multi-row insert and removed ones go in one
+        delete. Returns the ids that were actually followed and unfollowed.
+        Only the follows the insert added get timeline entries and reach the
+        follow graph; the others existed already, written by a concurrent
+        request or missed by a stale graph.
+        """
+        from app.counters import follows_changed
+        from app.sql import insert_ignore
+        from app.timeline import backfill, prune
+
+        follow_ids = set(follow_ids) - set(unfollow_ids) - {self.id}
+        followed = sorted(
+            user_id
+            for (user_id,) in db.session.query(User.id).filter(User.id.in_(follow_ids))
+            if not follow_graph.is_following(self.id, user_id)
+        )
+        unfollowed = sorted(
+            user_id
+            for user_id in set(unfollow_ids)
+            if follow_graph.is_following(self.id, user_id)
+        )
+        if followed:
+            now = datetime.utcnow()
+            result = db.session.execute(
+                insert_ignore(Follow.__table__).values(
+                    [
+                        {
+                            "follower_id": self.id,
+                            "followed_id": user_id,
+                            "timestamp": now,
+                        }
+                        for user_id in followed
+                    ]
+                )
+            )
+            if result.rowcount < len(followed):
+                # the rows inserted here are the ones carrying this timestamp
+                followed = sorted(
+                    user_id
+                    for (user_id,) in db.session.query(Follow.followed_id).filter(
+                        Follow.follower_id == self.id,
+                        Follow.followed_id.in_(followed),
+                        Follow.timestamp == now,
+                    )
+                )
+            follows_changed(self.id, followed, 1, len(followed))
+            for user_id in followed:
+                backfill(self.id, user_id)
+        if unfollowed:
+            removed = Follow.query.filter(
+                Follow.follower_id == self.id, Follow.followed_id.in_(unfollowed)
+            ).delete(synchronize_session=False)
+            follows_changed(self.id, unfollowed, -1, removed)
+            prune(self.id, *unfollowed)
+        if followed or unfollowed:
+            follow_graph.stage(
+                db.session,
+                [("+", self.id, user_id) for user_id in followed]
+                + [("-", self.id, user_id) for user_id in unfollowed],
+            )
+            db.session.commit()
+            for user_id in [self.id, *followed, *unfollowed]:
+                cache.bump("graph", user_id)
+        return followed, unfollowed
 
     def is_following(self, user):
-        if user.id == None:
-            return False
-        return self.follower.filter_by(followed_id=user.id).first() is not None
+        return follow_graph.is_following(self.id, user.id)
 
     def is_followed_by(self, user):
-        if user.id == None:
-            return False
-        return self.followed.filter_by(follower_id=user.id).first() is not None
+        return follow_graph.is_following(user.id, self.id)
+
+
+user_cache.watch(User)
+availability.watch(User)
 
 
 class AnonymousUser(AnonymousUserMixin):
@@ -156,13 +270,21 @@ class AnonymousUser(AnonymousUserMixin):
 login_manager.anonymous_user = AnonymousUser
 
 
-class Post(db.Model):
+class Post(SoftDeleteMixin, db.Model):
     __tablename__ = "posts"
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     title = db.Column(db.String(80), nullable=False)
     date_posted = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
     content = db.Column(db.Text, nullable=False)
+    content_html = db.Column(db.Text)
+    excerpt = db.Column(db.String(markup.EXCERPT_LENGTH))
     user_id = db.Column(db.Integer, db.ForeignKey("users.id"))
+    like_count = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+    comment_count = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+    __table_args__ = (
+        db.Index("ix_posts_date_posted_id", "date_posted", "id"),
+        db.Index("ix_posts_user_id_date_posted_id", "user_id", "date_posted", "id"),
+    )
     comments = db.relationship("Comment", backref="post", lazy="dynamic")
     liked = db.relationship(
         "Like",
@@ -176,6 +298,24 @@ class Post(db.Model):
         return f"<Post '{self.title}')>'"
 
 
+markup.watch(Post.content, "content_html", "excerpt")
+
+
+class OutboxMessage(db.Model):
+    __tablename__ = "outbox"
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    recipient = db.Column(db.String(120), nullable=False)
+    subject = db.Column(db.String(200), nullable=False)
+    body = db.Column(db.Text, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    next_attempt_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    last_error = db.Column(db.Text)
+
+    def __repr__(self):
+        return f"<OutboxMessage '{self.id}', '{self.recipient}')>'"
+
+
 class Role(db.Model):
     __tablename__ = "roles"
     id = db.Column(db.Integer, primary_key=True)
@@ -248,3 +388,9 @@ class Permission:
 class MyModelView(ModelView):
     def is_accessible(self):
         return current_user.role_id == 3
+
+    def delete_model(self, model):
+        from app.purge import delete_user
+
+        delete_user(model)
+        return True
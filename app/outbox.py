@@ -0,0 +1,116 @@
+"""Outgoing email queue.
+
+Requests only insert a row into ``outbox``; ``flask outbox work`` delivers
+the queued messages in batches over one authenticated SMTP connection and
+retries failures with exponential backoff. For local runs point MAIL_SERVER
+at a debugging server, e.g. ``python -m aiosmtpd -n -l localhost:8025`` with
+MAIL_PORT=8025 and MAIL_USE_TLS=0.
+"""
+import smtplib
+import time
+from datetime import datetime, timedelta
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from flask_mail import Message
+
+from app import db, mail
+from app.models import OutboxMessage
+
+outbox_cli = AppGroup("outbox", help="Deliver queued email.")
+
+# errors that concern a single message rather than the connection
+MESSAGE_ERRORS = (
+    smtplib.SMTPRecipientsRefused,
+    smtplib.SMTPSenderRefused,
+    smtplib.SMTPDataError,
+)
+
+
+def enqueue(recipient, subject, body):
+    message = OutboxMessage(recipient=recipient, subject=subject, body=body)
+    db.session.add(message)
+    db.session.commit()
+    return message
+
+
+def due_messages(limit):
+    return (
+        OutboxMessage.query.filter(OutboxMessage.next_attempt_at <= datetime.utcnow())
+        .order_by(OutboxMessage.id)
+        .limit(limit)
+        .with_for_update(skip_locked=True)
+        .all()
+    )
+
+
+def _defer(message, error):
+    config = current_app.config
+    message.attempts += 1
+    message.last_error = str(error)[:500]
+    if message.attempts >= config["MAIL_OUTBOX_MAX_ATTEMPTS"]:
+        # give up; the row stays in the table for inspection
+        message.next_attempt_at = None
+        current_app.logger.error(
+            "Giving up on email %s to %s: %s", message.id, message.recipient, error
+        )
+        return
+    delay = min(
+        config["MAIL_OUTBOX_RETRY_DELAY"] * 2 ** (message.attempts - 1),
+        config["MAIL_OUTBOX_MAX_RETRY_DELAY"],
+    )
+    message.next_attempt_at = datetime.utcnow() + timedelta(seconds=delay)
+
+
+def deliver(batch_size=100):
+    """Send every due message over a single SMTP connection.
+
+    Each batch is committed on its own, so a crash resends at most the batch
+    in flight. Returns the number of messages sent.
+    """
+    sent = 0
+    messages = due_messages(batch_size)
+    try:
+        if messages:
+            with mail.connect() as connection:
+                while messages:
+                    for message in messages:
+                        try:
+                            connection.send(
+                                Message(
+                                    message.subject,
+                                    recipients=[message.recipient],
+                                    body=message.body,
+                                )
+                            )
+                        except MESSAGE_ERRORS as e:
+                            _defer(message, e)
+                        else:
+                            db.session.delete(message)
+                            sent += 1
+                    db.session.commit()
+                    messages = due_messages(batch_size)
+    except (smtplib.SMTPException, OSError) as e:
+        # the connection failed; whatever was not sent yet is retried later
+        for message in messages:
+            if message not in db.session.deleted:
+                _defer(message, e)
+    db.session.commit()
+    return sent
+
+
+@outbox_cli.command("work")
+@click.option("--batch-size", default=100, help="Messages fetched per batch.")
+@click.option("--interval", default=2.0, help="Seconds to sleep when idle.")
+@click.option("--once", is_flag=True, help="Drain the queue once and exit.")
+def work(batch_size, interval, once):
+    """Send queued email until interrupted."""
+    while True:
+        sent = deliver(batch_size)
+        if sent:
+            current_app.logger.info("Sent %d queued emails", sent)
+        if once:
+            break
+        if not sent:
+            time.sleep(interval)
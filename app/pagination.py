@@ -0,0 +1,147 @@
+import base64
+import json
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+from flask import abort, current_app, request
+from sqlalchemy import and_, or_
+
+# key -> (count, expiry), least recently used first
+_totals = OrderedDict()
+_totals_lock = threading.Lock()
+
+
+class KeysetPage:
+    """One page of a listing ordered by a unique key such as (date_posted, id).
+
+    Pages are addressed with opaque ``after``/``before`` cursors built from
+    the key of the last/first row shown, so fetching a page is an index range
+    scan instead of an OFFSET scan.
+    """
+
+    def __init__(self, items, key, has_next, has_prev, total):
+        self.items = items
+        self.key = key
+        self.has_next = has_next
+        self.has_prev = has_prev
+        self.total = total
+
+    @property
+    def next_cursor(self):
+        if self.has_next and self.items:
+            return encode_cursor(self.key(self.items[-1]))
+
+    @property
+    def prev_cursor(self):
+        if self.has_prev and self.items:
+            return encode_cursor(self.key(self.items[0]))
+
+
+def encode_cursor(values):
+    values = [v.isoformat() if isinstance(v, datetime) else v for v in values]
+    raw = json.dumps(values, separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(token, columns):
+    try:
+        raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+        values = json.loads(raw)
+        if len(values) != len(columns):
+            raise ValueError(token)
+        return [
+            datetime.fromisoformat(value)
+            if column.type.python_type is datetime
+            else column.type.python_type(value)
+            for column, value in zip(columns, values)
+        ]
+    except (ValueError, TypeError):
+        abort(400)
+
+
+def _seek(columns, values, greater):
+    clauses = []
+    for i, column in enumerate(columns):
+        bound = column > values[i] if greater else column < values[i]
+        equal = [c == v for c, v in zip(columns[:i], values[:i])]
+        clauses.append(and_(*equal, bound))
+    return or_(*clauses)
+
+
+def keyset_paginate(
+    query,
+    columns,
+    after=None,
+    before=None,
+    last=False,
+    per_page=4,
+    ascending=False,
+    total=None,
+    key=None,
+):
+    if key is None:
+
+        def key(item):
+            return tuple(getattr(item, c.key) for c in columns)
+
+    forward = [c.asc() if ascending else c.desc() for c in columns]
+    backward = [c.desc() if ascending else c.asc() for c in columns]
+
+    if before or last:
+        if before:
+            query = query.filter(
+                _seek(columns, decode_cursor(before, columns), not ascending)
+            )
+        rows = query.order_by(*backward).limit(per_page + 1).all()
+        items = rows[:per_page][::-1]
+        return KeysetPage(items, key, bool(before), len(rows) > per_page, total)
+
+    if after:
+        query = query.filter(_seek(columns, decode_cursor(after, columns), ascending))
+    rows = query.order_by(*forward).limit(per_page + 1).all()
+    return KeysetPage(rows[:per_page], key, len(rows) > per_page, bool(after), total)
+
+
+def paginate_request(query, columns, per_page=4, ascending=False, total=None, key=None):
+    return keyset_paginate(
+        query,
+        columns,
+        after=request.args.get("after"),
+        before=request.args.get("before"),
+        last=request.args.get("last", 0, type=int) == 1,
+        per_page=per_page,
+        ascending=ascending,
+        total=total,
+        key=key,
+    )
+
+
+def cached_total(key, query):
+    """Return ``query.count()``, recounting only when the cached value expired.
+
+    Writers call :func:`invalidate_totals` so the owning process sees its own
+    changes at once; other processes catch up after PAGINATION_TOTAL_TTL.
+    At most PAGINATION_TOTAL_SIZE totals are kept, the least recently used
+    going first.
+    """
+    now = time.monotonic()
+    with _totals_lock:
+        entry = _totals.get(key)
+        if entry is not None and entry[1] > now:
+            _totals.move_to_end(key)
+            return entry[0]
+        _totals.pop(key, None)
+    total = query.order_by(None).count()
+    with _totals_lock:
+        _totals[key] = (total, now + current_app.config["PAGINATION_TOTAL_TTL"])
+        while len(_totals) > current_app.config["PAGINATION_TOTAL_SIZE"]:
+            _totals.popitem(last=False)
+    return total
+
+
+def invalidate_totals(*prefixes):
+    with _totals_lock:
+        for key in [key for key in _totals if key.startswith(prefixes)]:
+            del _totals[key]
@@ -0,0 +1,126 @@
+"""Connection pools that survive gunicorn's ``--preload`` fork.
+
+Pool sizes come from SQLALCHEMY_ENGINE_OPTIONS (SQLite keeps the pool
+Flask-SQLAlchemy gives it and ignores the sizes). Every pooled connection
+remembers the pid that opened it; a worker that checks out a connection
+inherited from the master discards it without closing the master's socket
+and opens its own. gunicorn.conf.py also disposes of the master's engines
+before each fork, so there is normally nothing to inherit.
+
+Time spent waiting for a connection is added to the request's metrics;
+pool occupancy, new connections and checkout timeouts are exported through
+the metrics collector.
+"""
+import os
+import threading
+import time
+from collections import Counter
+
+from flask import current_app, g, has_request_context
+from sqlalchemy import event, exc
+from sqlalchemy.pool import Pool, QueuePool
+
+SQLITE_IGNORED = ("pool_size", "max_overflow", "pool_timeout")
+
+
+class TimedQueuePool(QueuePool):
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            pool_stats.count("timeouts")
+            raise
+        finally:
+            if has_request_context():
+                stats = g.get("metrics")
+                if stats is not None:
+                    stats["pool_wait"] += time.perf_counter() - start
+
+
+def configure(sa_url, options):
+    """Adjust the engine options of one database before it is created."""
+    if sa_url.drivername.startswith("sqlite"):
+        for key in SQLITE_IGNORED:
+            options.pop(key, None)
+    else:
+        options.setdefault("poolclass", TimedQueuePool)
+
+
+class PoolStats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counts = Counter()
+
+    def count(self, name):
+        with self.lock:
+            self.counts[name] += 1
+
+    def collect(self):
+        from app import db
+
+        app = current_app._get_current_object()
+        binds = [None, *(app.config.get("SQLALCHEMY_BINDS") or ())]
+        occupancy = {"checked_out": [], "overflow": []}
+        for bind in binds:
+            pool = db.get_engine(app, bind=bind).pool
+            if isinstance(pool, QueuePool):
+                labels = {"bind": bind or "primary"}
+                occupancy["checked_out"].append((labels, pool.checkedout()))
+                occupancy["overflow"].append((labels, max(pool.overflow(), 0)))
+        yield (
+            "blog_db_pool_checked_out",
+            "gauge",
+            "Connections in use.",
+            occupancy["checked_out"],
+        )
+        yield (
+            "blog_db_pool_overflow",
+            "gauge",
+            "Connections open beyond pool_size.",
+            occupancy["overflow"],
+        )
+        with self.lock:
+            counts = dict(self.counts)
+        for name, help in (
+            ("connects", "New database connections."),
+            ("timeouts", "Checkouts that gave up after pool_timeout."),
+            ("forked", "Connections discarded because another process opened them."),
+        ):
+            yield (
+                f"blog_db_pool_{name}_total",
+                "counter",
+                help,
+                [({}, counts.get(name, 0))],
+            )
+
+
+pool_stats = PoolStats()
+
+
+def dispose_engines(app):
+    """Close every pooled connection of the app's engines."""
+    from app import db
+
+    for bind in [None, *(app.config.get("SQLALCHEMY_BINDS") or ())]:
+        db.get_engine(app, bind=bind).dispose()
+
+
+@event.listens_for(Pool, "connect")
+def _remember_pid(dbapi_connection, connection_record):
+    connection_record.info["pid"] = os.getpid()
+    pool_stats.count("connects")
+
+
+@event.listens_for(Pool, "checkout")
+def _check_pid(dbapi_connection, connection_record, connection_proxy):
+    if connection_record.info.get("pid", os.getpid()) != os.getpid():
+        # drop the inherited connection unclosed; closing it would end the
+        # session the other process still uses
+        connection_record.connection = None
+        connection_proxy.connection = None
+        pool_stats.count("forked")
+        raise exc.DisconnectionError(
+            "Connection record belongs to pid %s, attempting to check out in pid %s"
+            % (connection_record.info["pid"], os.getpid())
+        )
@@ -0,0 +1,136 @@
+"""Request-level sampling profiler.
+
+A fraction of requests (PROFILER_SAMPLE_RATE), plus every request to the
+endpoints in PROFILER_ENDPOINTS or to views decorated with
+:func:`app.decorators.profile`, is sampled: a background thread records the
+stack of the thread serving it every PROFILER_INTERVAL seconds. Stacks are
+aggregated across requests and written to PROFILER_DIR in the collapsed
+format that flamegraph.pl and speedscope read. With PROFILER_PSTATS the same
+requests also run under cProfile and are merged into one pstats file.
+"""
+import atexit
+import cProfile
+import os
+import pstats
+import random
+import sys
+import threading
+import time
+from collections import Counter
+
+from flask import current_app, g, request
+
+
+def collapse(frame, limit=128):
+    names = []
+    while frame is not None and len(names) < limit:
+        code = frame.f_code
+        names.append(f"{code.co_name} ({os.path.basename(code.co_filename)})")
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+class SamplingProfiler:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.active = {}
+        self.stacks = Counter()
+        self.stats = None
+        self.profiled = 0
+        self.thread = None
+        self.pid = None
+        self.wakeup = threading.Event()
+        self.enabled = False
+
+    def init_app(self, app):
+        config = app.config
+        self.enabled = config["PROFILER_ENABLED"]
+        self.sample_rate = config["PROFILER_SAMPLE_RATE"]
+        self.endpoints = set(config["PROFILER_ENDPOINTS"])
+        self.interval = config["PROFILER_INTERVAL"]
+        self.use_cprofile = config["PROFILER_PSTATS"]
+        self.flush_every = config["PROFILER_FLUSH_EVERY"]
+        self.output_dir = config["PROFILER_DIR"]
+        app.before_request(self._start)
+        app.teardown_request(self._stop)
+        atexit.register(self.flush)
+
+    def _wanted(self):
+        if not self.enabled:
+            return False
+        view = current_app.view_functions.get(request.endpoint)
+        if request.endpoint in self.endpoints or getattr(view, "_profile", False):
+            return True
+        return random.random() < self.sample_rate
+
+    def _ensure_sampler(self):
+        # threads do not survive a fork, so every worker starts its own
+        if self.pid != os.getpid():
+            self.pid = os.getpid()
+            self.thread = threading.Thread(
+                target=self._sample_loop, name="sampling-profiler", daemon=True
+            )
+            self.thread.start()
+
+    def _start(self):
+        if not self._wanted():
+            return
+        self._ensure_sampler()
+        with self.lock:
+            self.active[threading.get_ident()] = request.endpoint
+        self.wakeup.set()
+        g.profiling = True
+        if self.use_cprofile:
+            g.cprofile = cProfile.Profile()
+            g.cprofile.enable()
+
+    def _stop(self, exc):
+        if not g.pop("profiling", False):
+            return
+        profile = g.pop("cprofile", None)
+        if profile is not None:
+            profile.disable()
+        with self.lock:
+            self.active.pop(threading.get_ident(), None)
+            if profile is not None:
+                if self.stats is None:
+                    self.stats = pstats.Stats(profile)
+                else:
+                    self.stats.add(profile)
+            self.profiled += 1
+            flush = self.profiled % self.flush_every == 0
+        if flush:
+            self.flush()
+
+    def _sample_loop(self):
+        while True:
+            self.wakeup.clear()
+            if not self.active:
+                self.wakeup.wait()
+            time.sleep(self.interval)
+            frames = sys._current_frames()
+            with self.lock:
+                for ident, endpoint in self.active.items():
+                    frame = frames.get(ident)
+                    if frame is not None:
+                        self.stacks[f"{endpoint};{collapse(frame)}"] += 1
+
+    def flush(self):
+        """Write the stacks and stats aggregated by this process so far."""
+        with self.lock:
+            if not self.stacks and self.stats is None:
+                return
+            os.makedirs(self.output_dir, exist_ok=True)
+            pid = os.getpid()
+            path = os.path.join(self.output_dir, f"stacks-{pid}.folded")
+            with open(path + ".tmp", "w") as f:
+                for stack, count in self.stacks.most_common():
+                    f.write(f"{stack} {count}\n")
+            os.replace(path + ".tmp", path)
+            if self.stats is not None:
+                self.stats.dump_stats(
+                    os.path.join(self.output_dir, f"requests-{pid}.pstats")
+                )
+
+
+profiler = SamplingProfiler()
@@ -0,0 +1,217 @@
+"""Deleting posts, comments and users.
+
+The request only flags the rows (see :mod:`app.softdelete`), which hides
+them at once and touches a handful of rows. ``flask purge`` then removes the
+flagged rows together with their likes, comments, follows and timeline
+entries, ``chunk_size`` rows per statement and one commit per chunk, so no
+statement scans or locks a whole history at once.
+"""
+import time
+from datetime import datetime
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import select
+
+from app import counters, db
+from app.cache import cache
+from app.conditional import FEED, NAMES
+from app.followgraph import follow_graph
+from app.models import Comment, Follow, Like, Post, TimelineEntry, User
+from app.pagination import invalidate_totals
+from app.softdelete import soft_delete
+
+
+def delete_post(post):
+    deleted = soft_delete(Post.query.filter_by(id=post.id, deleted=False))
+    counters.adjust(User.post_count, [post.user_id], -deleted)
+    db.session.commit()
+    cache.bump("post", post.id)
+    cache.bump(*FEED)
+    cache.bump("posts-by", post.user_id)
+    invalidate_totals("posts", "following:")
+
+
+def delete_comment(comment):
+    deleted = soft_delete(Comment.query.filter_by(id=comment.id, deleted=False))
+    counters.adjust(Post.comment_count, [comment.post_id], -deleted)
+    db.session.commit()
+    cache.bump("comment", comment.id)
+    cache.bump("post", comment.post_id)
+
+
+def delete_user(user):
+    """Hide a user along with everything they wrote."""
+    # through the ORM, so the user cache drops its copy on commit
+    user.deleted = True
+    user.deleted_at = datetime.utcnow()
+    soft_delete(Post.query.filter_by(user_id=user.id))
+    soft_delete(Comment.query.filter_by(author_id=user.id))
+    counters.refresh(User.post_count, [user.id])
+    counters.refresh(
+        Post.comment_count,
+        select(Comment.post_id).where(Comment.author_id == user.id).distinct(),
+    )
+    db.session.commit()
+    cache.bump("user", user.id)
+    cache.bump(*NAMES)
+    cache.bump(*FEED)
+    invalidate_totals("posts", "following:")
+
+
+def _delete_chunks(table, where, key, chunk_size):
+    """Delete the rows matching ``where`` by ``key``, one chunk at a time."""
+    deleted = 0
+    while True:
+        chunk = select(key).where(where).limit(chunk_size)
+        result = db.session.execute(table.delete().where(where, key.in_(chunk)))
+        db.session.commit()
+        deleted += result.rowcount
+        if result.rowcount < chunk_size:
+            return deleted
+
+
+def _delete_counted(table, where, key, counter, chunk_size):
+    """Like :func:`_delete_chunks`, taking each row off ``counter`` of its key.
+
+    ``key`` must be unique among the rows ``where`` matches.
+    """
+    deleted = 0
+    while True:
+        ids = (
+            db.session.execute(select(key).where(where).limit(chunk_size))
+            .scalars()
+            .all()
+        )
+        if not ids:
+            return deleted
+        db.session.execute(table.delete().where(where, key.in_(ids)))
+        counters.adjust(counter, ids, -1)
+        db.session.commit()
+        deleted += len(ids)
+        if len(ids) < chunk_size:
+            return deleted
+
+
+def _flagged(model, chunk_size):
+    table = model.__table__
+    return (
+        db.session.execute(
+            select(table.c.id)
+            .where(table.c.deleted_at.isnot(None))
+            .order_by(table.c.id)
+            .limit(chunk_size)
+            .execution_options(include_deleted=True)
+        )
+        .scalars()
+        .all()
+    )
+
+
+def purge_posts(chunk_size):
+    likes = Like.__table__
+    comments = Comment.__table__
+    timeline = TimelineEntry.__table__
+    ids = _flagged(Post, chunk_size)
+    for post_id in ids:
+        _delete_chunks(likes, likes.c.post_id == post_id, likes.c.user_id, chunk_size)
+        _delete_chunks(
+            comments, comments.c.post_id == post_id, comments.c.id, chunk_size
+        )
+        _delete_chunks(
+            timeline, timeline.c.post_id == post_id, timeline.c.user_id, chunk_size
+        )
+    if ids:
+        db.session.execute(Post.__table__.delete().where(Post.id.in_(ids)))
+        db.session.commit()
+    return len(ids)
+
+
+def purge_comments(chunk_size):
+    comments = Comment.__table__
+    return _delete_chunks(
+        comments, comments.c.deleted_at.isnot(None), comments.c.id, chunk_size
+    )
+
+
+def purge_users(chunk_size):
+    likes = Like.__table__
+    follows = Follow.__table__
+    timeline = TimelineEntry.__table__
+    comments = Comment.__table__
+    purged = 0
+    for user_id in _flagged(User, chunk_size):
+        posts_left = db.session.execute(
+            select(Post.__table__.c.id)
+            .where(Post.__table__.c.user_id == user_id)
+            .limit(1)
+            .execution_options(include_deleted=True)
+        ).first()
+        if posts_left:
+            # wait for purge_posts; posts written after the user was deleted
+            # are flagged now and go with the next pass
+            soft_delete(Post.query.filter_by(user_id=user_id, deleted=False))
+            db.session.commit()
+            continue
+        _delete_counted(
+            likes,
+            likes.c.user_id == user_id,
+            likes.c.post_id,
+            Post.like_count,
+            chunk_size,
+        )
+        _delete_counted(
+            follows,
+            follows.c.follower_id == user_id,
+            follows.c.followed_id,
+            User.follower_count,
+            chunk_size,
+        )
+        _delete_counted(
+            follows,
+            follows.c.followed_id == user_id,
+            follows.c.follower_id,
+            User.following_count,
+            chunk_size,
+        )
+        _delete_chunks(
+            timeline, timeline.c.user_id == user_id, timeline.c.post_id, chunk_size
+        )
+        _delete_chunks(
+            comments, comments.c.author_id == user_id, comments.c.id, chunk_size
+        )
+        db.session.execute(User.__table__.delete().where(User.id == user_id))
+        db.session.commit()
+        purged += 1
+    if purged:
+        # follows were removed behind the follow graph's back
+        follow_graph.invalidate()
+    return purged
+
+
+def purge(chunk_size=1000):
+    """Remove one batch of flagged rows of each kind; returns the counts."""
+    return {
+        "posts": purge_posts(chunk_size),
+        "comments": purge_comments(chunk_size),
+        "users": purge_users(chunk_size),
+    }
+
+
+@click.command("purge")
+@click.option("--chunk-size", default=1000, help="Rows removed per statement.")
+@click.option("--loop", is_flag=True, help="Keep purging until interrupted.")
+@click.option("--interval", default=60.0, help="Seconds to sleep when idle.")
+@with_appcontext
+def purge_cli(chunk_size, loop, interval):
+    """Remove deleted posts, comments and users for good."""
+    while True:
+        counts = purge(chunk_size)
+        if any(counts.values()):
+            current_app.logger.info("Purged %s", counts)
+        if not loop:
+            click.echo(", ".join(f"{name}: {n}" for name, n in counts.items()))
+            break
+        if not any(counts.values()):
+            time.sleep(interval)
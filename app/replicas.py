@@ -0,0 +1,134 @@
+"""Read replicas for GET traffic.
+
+SQLALCHEMY_REPLICA_URIS lists databases that replicate the primary. While a
+GET or HEAD request has not written anything, its session sends SELECTs to
+one replica, picked once per session. Everything else stays on the primary:
+other methods, commands and workers, flushes, SELECT ... FOR UPDATE, textual
+statements, statements with the ``use_primary`` execution option and
+everything after the session wrote. A request that committed a write keeps
+that client on the primary for SQLALCHEMY_REPLICA_STICKY seconds, so the
+page it redirects to reads its own writes. A replica that
+refuses connections is skipped for SQLALCHEMY_REPLICA_RETRY seconds.
+
+Two SQLite files are enough to try it out: copy the database and point
+``DATABASE_REPLICA_URLS`` at the copy.
+"""
+import random
+import time
+
+from flask import has_request_context, request, session
+from flask_sqlalchemy import SignallingSession, SQLAlchemy
+from sqlalchemy import event, exc, orm
+
+from app import pool
+
+STICKY_KEY = "_primary_until"
+
+
+class Replicas:
+    def __init__(self):
+        self.keys = []
+        self.down = {}
+        self.sticky = 5
+        self.retry = 30
+
+    def init_app(self, app):
+        self.sticky = app.config["SQLALCHEMY_REPLICA_STICKY"]
+        self.retry = app.config["SQLALCHEMY_REPLICA_RETRY"]
+        # the replicas are ordinary binds without tables, so Flask-SQLAlchemy
+        # creates, pools and records their engines like the primary's
+        binds = dict(app.config.get("SQLALCHEMY_BINDS") or {})
+        self.keys = []
+        for n, uri in enumerate(app.config["SQLALCHEMY_REPLICA_URIS"]):
+            key = f"replica_{n}"
+            binds[key] = uri
+            self.keys.append(key)
+        app.config["SQLALCHEMY_BINDS"] = binds or None
+
+    def wanted(self):
+        return (
+            bool(self.keys)
+            and has_request_context()
+            and request.method in ("GET", "HEAD")
+            and session.get(STICKY_KEY, 0) < time.time()
+        )
+
+    def pick(self, db, app):
+        """Return the engine of a replica that accepts connections, if any."""
+        now = time.monotonic()
+        keys = [key for key in self.keys if self.down.get(key, 0) <= now]
+        random.shuffle(keys)
+        for key in keys:
+            engine = db.get_engine(app, bind=key)
+            try:
+                # the pool keeps this connection for the session to reuse
+                engine.connect().close()
+            except exc.DBAPIError:
+                app.logger.warning("Replica %s is unavailable", key, exc_info=True)
+                self.down[key] = now + self.retry
+                continue
+            return engine
+        return None
+
+
+replicas = Replicas()
+
+
+def _wants_primary(clause):
+    return clause is not None and clause._execution_options.get("use_primary", False)
+
+
+def _is_read(clause):
+    return (
+        clause is not None
+        and clause.is_select
+        and getattr(clause, "_for_update_arg", None) is None
+    )
+
+
+class RoutingSession(SignallingSession):
+    def __init__(self, db, **options):
+        super().__init__(db, **options)
+        self.db = db
+        # None until the first read decides; False means the primary
+        self.replica = None
+
+    def get_bind(self, mapper=None, clause=None, **kwargs):
+        if _wants_primary(clause):
+            # reads that must not lag, e.g. an index built from the table
+            return super().get_bind(mapper, clause)
+        if self.replica is not False and not self._flushing and _is_read(clause):
+            if self.replica is None:
+                self.replica = (
+                    replicas.wanted() and replicas.pick(self.db, self.app)
+                ) or False
+            if self.replica is not False:
+                return self.replica
+        elif not _is_read(clause):
+            self.info["replica_wrote"] = True
+            self.replica = False
+        return super().get_bind(mapper, clause)
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+    def create_engine(self, sa_url, engine_opts):
+        pool.configure(sa_url, engine_opts)
+        return super().create_engine(sa_url, engine_opts)
+
+
+@event.listens_for(RoutingSession, "after_commit")
+def _stick_to_primary(db_session):
+    if (
+        db_session.info.pop("replica_wrote", False)
+        and replicas.keys
+        and has_request_context()
+    ):
+        session[STICKY_KEY] = time.time() + replicas.sticky
+
+
+@event.listens_for(RoutingSession, "after_soft_rollback")
+def _forget_writes(db_session, previous_transaction):
+    db_session.info.pop("replica_wrote", None)
@@ -0,0 +1,198 @@
+"""Full-text search over posts and comments.
+
+The database keeps the index current by itself, so every write path is
+covered: the views, ``flask purge``, ``flask data import`` and bulk updates.
+
+* SQLite: FTS5 tables ``posts_fts`` and ``comments_fts`` index the rows'
+  text without storing it a second time, and triggers on the base tables
+  keep them up to date.
+* PostgreSQL: a trigger fills a ``search_vector`` tsvector column, which a
+  GIN index covers.
+
+Results are ranked, with title matches weighted above body matches, and
+paged with keyset cursors over (rank, id). Soft-deleted rows stay in the
+index but are filtered out like everywhere else.
+"""
+import re
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from sqlalchemy import column, event, func, literal_column, select, table, text
+from sqlalchemy.orm import joinedload
+
+from app import db
+from app.feed import CARD_OPTIONS
+from app.models import Comment, Post
+from app.pagination import KeysetPage, paginate_request
+
+LANGUAGE = "english"
+# the indexed columns of each table and their weights
+DOCUMENTS = {
+    "posts": (("title", "A"), ("content", "B")),
+    "comments": (("body", "A"),),
+}
+MODELS = {"posts": Post, "comments": Comment}
+# ts_rank_cd's default weights, so both backends rank alike
+BM25_WEIGHTS = {"A": 1.0, "B": 0.4}
+
+search_cli = AppGroup("search", help="Maintain the full-text index.")
+
+
+def _names(name):
+    return ", ".join(field for field, _ in DOCUMENTS[name])
+
+
+def _vector(name, row=""):
+    return " || ".join(
+        f"setweight(to_tsvector('{LANGUAGE}', coalesce({row}{field}, '')), '{weight}')"
+        for field, weight in DOCUMENTS[name]
+    )
+
+
+def create_statements(dialect, name):
+    names = _names(name)
+    if dialect == "postgresql":
+        return [
+            f"ALTER TABLE {name} ADD COLUMN IF NOT EXISTS search_vector tsvector",
+            f"CREATE OR REPLACE FUNCTION {name}_search_vector() RETURNS trigger "
+            f"LANGUAGE plpgsql AS $$ BEGIN "
+            f"NEW.search_vector := {_vector(name, 'NEW.')}; RETURN NEW; END $$",
+            f"DROP TRIGGER IF EXISTS {name}_search_vector ON {name}",
+            f"CREATE TRIGGER {name}_search_vector "
+            f"BEFORE INSERT OR UPDATE OF {names} ON {name} "
+            f"FOR EACH ROW EXECUTE PROCEDURE {name}_search_vector()",
+            f"CREATE INDEX IF NOT EXISTS ix_{name}_search_vector "
+            f"ON {name} USING gin (search_vector)",
+        ]
+    fts = f"{name}_fts"
+    old = ", ".join(f"old.{field}" for field, _ in DOCUMENTS[name])
+    new = ", ".join(f"new.{field}" for field, _ in DOCUMENTS[name])
+    remove = (
+        f"INSERT INTO {fts}({fts}, rowid, {names}) VALUES ('delete', old.id, {old});"
+    )
+    add = f"INSERT INTO {fts}(rowid, {names}) VALUES (new.id, {new});"
+    return [
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5({names}, "
+        f"content='{name}', content_rowid='id', tokenize='porter unicode61')",
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_insert AFTER INSERT ON {name} "
+        f"BEGIN {add} END",
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_delete AFTER DELETE ON {name} "
+        f"BEGIN {remove} END",
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_update AFTER UPDATE OF {names} "
+        f"ON {name} BEGIN {remove} {add} END",
+    ]
+
+
+def drop_statements(dialect, name):
+    if dialect == "postgresql":
+        return [f"DROP FUNCTION IF EXISTS {name}_search_vector() CASCADE"]
+    return [f"DROP TABLE IF EXISTS {name}_fts"]
+
+
+def _install(target, connection, **kw):
+    for statement in create_statements(connection.dialect.name, target.name):
+        connection.exec_driver_sql(statement)
+
+
+def _uninstall(target, connection, **kw):
+    for statement in drop_statements(connection.dialect.name, target.name):
+        connection.exec_driver_sql(statement)
+
+
+# db.create_all() builds the index too; migrations do it on existing tables
+for model in MODELS.values():
+    event.listen(model.__table__, "after_create", _install)
+    event.listen(model.__table__, "after_drop", _uninstall)
+
+
+def _terms(query):
+    return re.findall(r"\w+", query.lower())
+
+
+def search_query(name, query):
+    """Return the matching rows as (instance, rank) and the keyset columns."""
+    model = MODELS[name]
+    terms = _terms(query)
+    if db.engine.dialect.name == "postgresql":
+        vector = literal_column(f"{name}.search_vector")
+        tsquery = func.plainto_tsquery(LANGUAGE, " ".join(terms))
+        rank = func.ts_rank_cd(vector, tsquery, type_=db.Float)
+        matches = model.query.filter(vector.op("@@")(tsquery))
+    else:
+        fts = table(f"{name}_fts", column("rowid"))
+        weights = [BM25_WEIGHTS[weight] for _, weight in DOCUMENTS[name]]
+        # bm25() is lower for better matches
+        rank = -func.bm25(literal_column(fts.name), *weights, type_=db.Float)
+        # quoted, so user input is never read as FTS5 query syntax
+        phrase = " ".join(f'"{term}"' for term in terms)
+        matches = model.query.join(fts, fts.c.rowid == model.id).filter(
+            literal_column(fts.name).match(phrase)
+        )
+    if name == "posts":
+        matches = matches.options(joinedload(Post.author), *CARD_OPTIONS)
+    else:
+        matches = matches.options(joinedload(Comment.author), joinedload(Comment.post))
+    return matches.add_columns(rank.label("rank")), (rank, model.id)
+
+
+def search_page(name, query):
+    def key(row):
+        return (row.rank, row[0].id)
+
+    if not _terms(query):
+        return KeysetPage([], key, False, False, None)
+    matches, columns = search_query(name, query)
+    return paginate_request(
+        matches, columns, per_page=current_app.config["SEARCH_PER_PAGE"], key=key
+    )
+
+
+def reindex(name, chunk_size=1000):
+    """Rebuild one index ``chunk_size`` rows at a time; returns the row count."""
+    source = MODELS[name].__table__
+    names = _names(name)
+    sqlite = db.engine.dialect.name != "postgresql"
+    if sqlite:
+        fts = f"{name}_fts"
+        db.session.execute(text(f"INSERT INTO {fts}({fts}) VALUES ('delete-all')"))
+        fill = text(
+            f"INSERT INTO {fts}(rowid, {names}) SELECT id, {names} FROM {name} "
+            f"WHERE id BETWEEN :first AND :last"
+        )
+    else:
+        fill = text(
+            f"UPDATE {name} SET search_vector = {_vector(name)} "
+            f"WHERE id BETWEEN :first AND :last"
+        )
+    indexed = 0
+    after = 0
+    while True:
+        ids = (
+            db.session.execute(
+                select(source.c.id)
+                .where(source.c.id > after)
+                .order_by(source.c.id)
+                .limit(chunk_size)
+                .execution_options(include_deleted=True)
+            )
+            .scalars()
+            .all()
+        )
+        if not ids:
+            break
+        db.session.execute(fill, {"first": ids[0], "last": ids[-1]})
+        db.session.commit()
+        indexed += len(ids)
+        after = ids[-1]
+    db.session.commit()
+    return indexed
+
+
+@search_cli.command("reindex")
+@click.option("--chunk-size", default=1000, help="Rows indexed per transaction.")
+@click.argument("names", nargs=-1, type=click.Choice(sorted(DOCUMENTS)))
+def reindex_cli(chunk_size, names):
+    """Rebuild the search index of posts and comments (or just NAMES)."""
+    for name in names or sorted(DOCUMENTS, reverse=True):
+        click.echo(f"{name}: {reindex(name, chunk_size)} rows indexed")
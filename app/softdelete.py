@@ -0,0 +1,44 @@
+"""Soft deletion for users, posts and comments.
+
+Deleting only sets ``deleted``; every ORM select then leaves those rows out
+(pass the ``include_deleted`` execution option to see them), and ``flask
+purge`` removes them and their dependents later in small set-based chunks.
+"""
+from datetime import datetime
+
+from sqlalchemy import event, false
+from sqlalchemy.orm import Session, with_loader_criteria
+
+from app import db
+
+
+class SoftDeleteMixin:
+    deleted = db.Column(
+        db.Boolean, nullable=False, default=False, server_default=false()
+    )
+    deleted_at = db.Column(db.DateTime, index=True)
+
+
+def soft_delete(query):
+    """Mark every row matched by ``query`` as deleted with one UPDATE."""
+    return query.update(
+        {"deleted": True, "deleted_at": datetime.utcnow()},
+        synchronize_session=False,
+    )
+
+
+@event.listens_for(Session, "do_orm_execute")
+def _hide_deleted(execute_state):
+    if (
+        execute_state.is_select
+        and not execute_state.is_column_load
+        and not execute_state.is_relationship_load
+        and not execute_state.execution_options.get("include_deleted", False)
+    ):
+        execute_state.statement = execute_state.statement.options(
+            with_loader_criteria(
+                SoftDeleteMixin,
+                lambda cls: cls.deleted == false(),
+                include_aliases=True,
+            )
+        )
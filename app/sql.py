@@ -0,0 +1,13 @@
+"""Statements whose syntax differs between PostgreSQL and SQLite."""
+from sqlalchemy.dialects import postgresql, sqlite
+
+from app import db
+
+
+def insert_ignore(table):
+    """``INSERT ... ON CONFLICT DO NOTHING`` for the configured database."""
+    if db.engine.dialect.name == "postgresql":
+        insert = postgresql.insert
+    else:
+        insert = sqlite.insert
+    return insert(table).on_conflict_do_nothing()
@@ -1,13 +1,105 @@
-$(document).ready(function() {
-    $('.likeButton').on('click', function() {
-        var like = $('#likeId').val();
-        var unlike = $('#unlikeId').val();
-        var post_id = $('#post_idd').val():
-
-        req = $.ajax({
-            url : '/like/' +post_id,
-            type : 'POST',
-            data : {} 
+document.addEventListener('click', function (event) {
+    var link = event.target.closest('.like-toggle');
+    if (!link) {
+        return;
+    }
+    event.preventDefault();
+    if (link.dataset.pending) {
+        return;
+    }
+    link.dataset.pending = 'true';
+    var liked = link.dataset.liked === 'true';
+    fetch(liked ? link.dataset.unlikeUrl : link.dataset.likeUrl, {
+        method: 'POST',
+        credentials: 'same-origin',
+        headers: {'X-Requested-With': 'XMLHttpRequest'}
+    })
+        .then(function (response) {
+            if (!response.ok) {
+                throw new Error(response.status);
+            }
+            return response.json();
+        })
+        .then(function (data) {
+            link.dataset.liked = data.liked ? 'true' : 'false';
+            link.textContent = (data.liked ? 'Unlike' : 'Like') + ' (' + data.like_count + ')';
         })
+        .catch(function () {
+            window.location.reload();
+        })
+        .finally(function () {
+            delete link.dataset.pending;
+        });
+});
+
+document.addEventListener('click', function (event) {
+    var link = event.target.closest('.follow-toggle');
+    if (!link) {
+        return;
+    }
+    event.preventDefault();
+    if (link.dataset.pending) {
+        return;
+    }
+    link.dataset.pending = 'true';
+    var following = link.dataset.following === 'true';
+    fetch(following ? link.dataset.unfollowUrl : link.dataset.followUrl, {
+        method: 'POST',
+        credentials: 'same-origin',
+        headers: {'X-Requested-With': 'XMLHttpRequest'}
     })
-})
\ No newline at end of file
+        .then(function (response) {
+            if (!response.ok) {
+                throw new Error(response.status);
+            }
+            return response.json();
+        })
+        .then(function (data) {
+            link.dataset.following = data.following ? 'true' : 'false';
+            link.textContent = data.following ? 'Unfollow' : 'Follow';
+            var count = document.querySelector('.followers-count');
+            if (count) {
+                count.innerHTML = '&nbsp;' + data.followers + '&nbsp;';
+            }
+        })
+        .catch(function () {
+            window.location.reload();
+        })
+        .finally(function () {
+            delete link.dataset.pending;
+        });
+});
+
+var availabilityMessages = {
+    username: 'This user already exist',
+    email: 'This email is already in use'
+};
+
+document.addEventListener('change', function (event) {
+    var input = event.target;
+    var form = input.closest('form[data-availability-url]');
+    if (!form || !availabilityMessages[input.name] || !input.value) {
+        return;
+    }
+    var value = input.value;
+    var url = form.dataset.availabilityUrl + '?' +
+        new URLSearchParams([[input.name, value]]).toString();
+    fetch(url, {credentials: 'same-origin'})
+        .then(function (response) {
+            return response.ok ? response.json() : null;
+        })
+        .then(function (data) {
+            // ignore answers about a value the user has already changed
+            if (!data || input.value !== value) {
+                return;
+            }
+            var message = input.parentNode.querySelector('.availability-feedback');
+            if (!message) {
+                message = document.createElement('div');
+                message.className = 'invalid-feedback availability-feedback';
+                input.insertAdjacentElement('afterend', message);
+            }
+            input.classList.toggle('is-invalid', !data[input.name]);
+            message.textContent = data[input.name] ? '' : availabilityMessages[input.name];
+        });
+});
@@ -0,0 +1,135 @@
+"""Materialized /following timelines.
+
+Every post is pushed to a row per follower when it is written (fan-out on
+write), so reading a timeline is a range scan over
+``timeline_entries(user_id, date_posted, post_id)``. Authors with more than
+TIMELINE_FANOUT_LIMIT followers are not fanned out; their posts are pulled in
+at read time instead, so one post never writes an unbounded number of rows.
+Skipping an author sets ``users.timeline_pull``, and flagged authors stay on
+the pull path even after they fall back under the limit, since the posts
+they wrote while heavy were never pushed. A new follow copies the followed
+author's latest TIMELINE_BACKFILL posts, and :func:`rebuild` follows the
+same rules.
+"""
+from flask import current_app
+from sqlalchemy import false, func, literal, or_, select, update
+
+from app import db
+from app.followgraph import follow_graph
+from app.models import Follow, Post, TimelineEntry, User
+
+COLUMNS = ["user_id", "post_id", "date_posted", "author_id"]
+
+
+def is_heavy_author(user_id):
+    followers = follow_graph.followers_count(user_id)
+    return followers > current_app.config["TIMELINE_FANOUT_LIMIT"]
+
+
+def _pull(user_id):
+    """Read the author's posts with the pull path from now on."""
+    db.session.execute(
+        update(User)
+        .where(User.id == user_id, User.timeline_pull == false())
+        .values(timeline_pull=True)
+        .execution_options(synchronize_session=False)
+    )
+
+
+def pulled_author_ids(user_id):
+    """Authors followed by ``user_id`` whose posts are read with the pull path."""
+    return [
+        followed_id
+        for (followed_id,) in db.session.query(Follow.followed_id)
+        .join(User, User.id == Follow.followed_id)
+        .filter(Follow.follower_id == user_id, User.timeline_pull)
+    ]
+
+
+def fan_out(post):
+    if is_heavy_author(post.user_id):
+        _pull(post.user_id)
+        return
+    followers = select(
+        Follow.follower_id,
+        literal(post.id),
+        literal(post.date_posted),
+        literal(post.user_id),
+    ).where(Follow.followed_id == post.user_id)
+    db.session.execute(TimelineEntry.__table__.insert().from_select(COLUMNS, followers))
+
+
+def backfill(follower_id, followed_id):
+    if is_heavy_author(followed_id):
+        _pull(followed_id)
+        return
+    recent = (
+        select(literal(follower_id), Post.id, Post.date_posted, Post.user_id)
+        .where(Post.user_id == followed_id)
+        .order_by(Post.date_posted.desc())
+        .limit(current_app.config["TIMELINE_BACKFILL"])
+    )
+    db.session.execute(TimelineEntry.__table__.insert().from_select(COLUMNS, recent))
+
+
+def prune(follower_id, *followed_ids):
+    TimelineEntry.query.filter(
+        TimelineEntry.user_id == follower_id,
+        TimelineEntry.author_id.in_(followed_ids),
+    ).delete(synchronize_session=False)
+
+
+def rebuild():
+    """Recreate every timeline from the follows and posts tables.
+
+    As if every follow had just been made: authors over the fan-out limit
+    are pulled, the others contribute their latest TIMELINE_BACKFILL posts.
+    """
+    limit = current_app.config["TIMELINE_FANOUT_LIMIT"]
+    heavy = (
+        select(Follow.followed_id)
+        .group_by(Follow.followed_id)
+        .having(func.count() > limit)
+    )
+    db.session.execute(
+        update(User)
+        .values(timeline_pull=User.id.in_(heavy))
+        .execution_options(synchronize_session=False)
+    )
+    db.session.execute(TimelineEntry.__table__.delete())
+    ranked = select(
+        Post.id,
+        Post.date_posted,
+        Post.user_id,
+        func.row_number()
+        .over(
+            partition_by=Post.user_id,
+            order_by=(Post.date_posted.desc(), Post.id.desc()),
+        )
+        .label("recency"),
+    ).subquery()
+    recent = (
+        select(Follow.follower_id, ranked.c.id, ranked.c.date_posted, ranked.c.user_id)
+        .join(ranked, ranked.c.user_id == Follow.followed_id)
+        .where(
+            ranked.c.recency <= current_app.config["TIMELINE_BACKFILL"],
+            Follow.followed_id.not_in(heavy),
+        )
+    )
+    db.session.execute(TimelineEntry.__table__.insert().from_select(COLUMNS, recent))
+
+
+def timeline_query(user_id):
+    """Return ``(query, keyset columns)`` for the posts on a user's timeline."""
+    heavy = pulled_author_ids(user_id)
+    if not heavy:
+        query = Post.query.join(TimelineEntry, TimelineEntry.post_id == Post.id).filter(
+            TimelineEntry.user_id == user_id
+        )
+        return query, (TimelineEntry.date_posted, TimelineEntry.post_id)
+
+    pushed = db.session.query(TimelineEntry.post_id).filter(
+        TimelineEntry.user_id == user_id
+    )
+    query = Post.query.filter(or_(Post.id.in_(pushed), Post.user_id.in_(heavy)))
+    return query, (Post.date_posted, Post.id)
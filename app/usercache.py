@@ -0,0 +1,149 @@
+"""Per-process cache of the users loaded by Flask-Login on every request.
+
+Entries are plain snapshots of the user row that are merged back into the
+request's session without a query. Every user has a stamp file whose mtime
+is bumped after a commit that changed the row; all workers on the host check
+that stamp on each hit, so an update in one worker is seen by the others on
+their next request. USER_CACHE_TTL bounds staleness across hosts.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session, make_transient_to_detached, object_session
+from sqlalchemy.orm.attributes import set_committed_value
+
+from app import db
+
+# not the counters: app.counters updates them without the ORM, so a snapshot
+# would not notice; reading them loads the current values
+SNAPSHOT_FIELDS = (
+    "id",
+    "username",
+    "email",
+    "password",
+    "about_me",
+    "picture",
+    "member_since",
+    "confirmed",
+    "role_id",
+    "deleted",
+)
+
+
+class UserCache:
+    def __init__(self):
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.maxsize = 1024
+        self.ttl = 300
+        self.stamp_dir = None
+
+    def init_app(self, app):
+        self.maxsize = app.config["USER_CACHE_SIZE"]
+        self.ttl = app.config["USER_CACHE_TTL"]
+        self.stamp_dir = app.config["USER_CACHE_DIR"]
+        os.makedirs(self.stamp_dir, exist_ok=True)
+
+    def watch(self, model):
+        """Invalidate a user's entry whenever a commit updates or deletes it."""
+
+        def mark(mapper, connection, target):
+            session = object_session(target)
+            if session.is_modified(target, include_collections=False):
+                session.info.setdefault("user_cache_dirty", set()).add(target.id)
+
+        event.listen(model, "after_update", mark)
+        event.listen(model, "after_delete", mark)
+
+    def _stamp_path(self, user_id):
+        return os.path.join(self.stamp_dir, str(user_id))
+
+    def _stamp(self, user_id):
+        try:
+            return os.stat(self._stamp_path(user_id)).st_mtime_ns
+        except FileNotFoundError:
+            return 0
+
+    def get(self, model, user_id):
+        stamp = self._stamp(user_id)
+        with self.lock:
+            entry = self.entries.get(user_id)
+            if entry and entry[1] == stamp and entry[2] > time.monotonic():
+                self.entries.move_to_end(user_id)
+                self.hits += 1
+                snapshot = entry[0]
+            else:
+                self.misses += 1
+                snapshot = None
+        if snapshot is not None:
+            return self._attach(model, snapshot)
+
+        # from the primary: a stale row read from a lagging replica would be
+        # kept under the new stamp until the entry expires
+        user = model.query.execution_options(use_primary=True).get(user_id)
+        if user is not None:
+            snapshot = {field: getattr(user, field) for field in SNAPSHOT_FIELDS}
+            with self.lock:
+                self.entries[user_id] = (snapshot, stamp, time.monotonic() + self.ttl)
+                self.entries.move_to_end(user_id)
+                while len(self.entries) > self.maxsize:
+                    self.entries.popitem(last=False)
+        return user
+
+    def _attach(self, model, snapshot):
+        user = model.__mapper__.class_manager.new_instance()
+        for field, value in snapshot.items():
+            set_committed_value(user, field, value)
+        make_transient_to_detached(user)
+        return db.session.merge(user, load=False)
+
+    def invalidate(self, user_id):
+        with self.lock:
+            self.entries.pop(user_id, None)
+            self.invalidations += 1
+        path = self._stamp_path(user_id)
+        with open(path, "a"):
+            pass
+        now = time.time_ns()
+        os.utime(path, ns=(now, now))
+
+    def collect(self):
+        stats = self.stats()
+        yield "blog_user_cache_size", "gauge", "Cached users.", [({}, stats["size"])]
+        for name in ("hits", "misses", "invalidations"):
+            yield (
+                f"blog_user_cache_{name}_total",
+                "counter",
+                f"User cache {name}.",
+                [({}, stats[name])],
+            )
+
+    def stats(self):
+        with self.lock:
+            return {
+                "size": len(self.entries),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "invalidations": self.invalidations,
+            }
+
+
+user_cache = UserCache()
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_committed(session):
+    for user_id in session.info.pop("user_cache_dirty", ()):
+        user_cache.invalidate(user_id)
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def _forget_rolled_back(session, previous_transaction):
+    session.info.pop("user_cache_dirty", None)
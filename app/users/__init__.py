@@ -2,6 +2,7 @@ from flask.templating import render_template
 from flask_login import current_user
 from flask_login.utils import login_required
 
+from app.images import picture_url
 from app.models import Permission
 
 from .routes import users
@@ -9,4 +10,4 @@ from .routes import users
 
 @users.app_context_processor
 def inject_permissions():
-    return {"Permission": Permission}
+    return {"Permission": Permission, "picture_url": picture_url}
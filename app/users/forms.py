@@ -7,6 +7,7 @@ from wtforms.fields.simple import TextAreaField
 from wtforms.validators import (DataRequired, EqualTo, Length, Regexp,
                                 ValidationError)
 
+from app.availability import availability
 from app.models import User
 
 
@@ -31,16 +32,21 @@ class RegisterForm(FlaskForm):
     )
     submit = SubmitField("Submit")
 
-    def validate_username(self, username):
-        user = User.query.filter_by(username=username.data).first()
+    def _taken(self):
+        # one lookup covers both fields; WTForms validates them one by one.
+        # Not prefiltered: the Bloom filter misses users from other hosts
+        if not hasattr(self, "_taken_fields"):
+            self._taken_fields = availability.taken(
+                prefilter=False, username=self.username.data, email=self.email.data
+            )
+        return self._taken_fields
 
-        if user:
+    def validate_username(self, username):
+        if "username" in self._taken():
             raise ValidationError("This user already exist")
 
     def validate_email(self, email):
-        user = User.query.filter_by(email=email.data).first()
-
-        if user:
+        if "email" in self._taken():
             raise ValidationError("This email is already in use")
 
 
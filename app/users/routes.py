@@ -1,12 +1,18 @@
-from flask import (Blueprint, current_app, flash, redirect, render_template,
-                   request, url_for)
+from flask import (Blueprint, abort, current_app, flash, jsonify, redirect,
+                   render_template, request, url_for)
 from flask.helpers import url_for
 from flask_login import current_user, login_required, login_user, logout_user
 from flask_login.utils import login_user
 
 from app import bcrypt, db
+from app.availability import availability
+from app.cache import cache
+from app.conditional import FEED, NAMES, not_modified
 from app.decorators import profile
-from app.models import Follow, Post, User
+from app.feed import load_feed
+from app.followgraph import follow_graph
+from app.models import Post, User
+from app.pagination import invalidate_totals
 from app.users.forms import (LoginForm, RegisterForm, RequestResetForm,
                              ResetPasswordForm, UpdateAccount)
 from app.users.utils import (reset_password_mail, save_picture,
@@ -73,12 +79,10 @@ def account():
     else:
         count = 0  # making sure that at least one element was changed so that the user can be directed to the home page with a flash message
         form = UpdateAccount()
-        page = request.args.get("page", 1, type=int)
-
-        pagin = (
-            Post.query.filter_by(user_id=current_user.id)
-            .order_by(Post.date_posted.desc())
-            .paginate(page=page, per_page=4)
+        pagin = load_feed(
+            Post.query.filter_by(user_id=current_user.id),
+            current_user,
+            total=current_user.post_count,
         )
 
         if form.username.data:
@@ -107,12 +111,16 @@ def account():
 
         if count > 0:
             db.session.commit()
+            cache.bump("user", current_user.id)
+            if form.username.data:
+                cache.bump(*NAMES)
+                cache.bump(*FEED)
             flash("Account updated successfully!", "success")
             return redirect(url_for("users.account"))
         # if current_user.picture:
         #     image_file = url_for('static', filename='profile_pics/' + current_user.picture)
     return render_template(
-        "account.html", form=form, page=page, pagin=pagin
+        "account.html", form=form, pagin=pagin
     )  # , image_file=image_file)
 
 
@@ -136,76 +144,107 @@ def user(id):
     if not current_user.confirmed:
         return render_template("unconfirmed.html")
     else:
+        cached = not_modified(
+            ("user", id), ("posts-by", id), ("graph", id), ("graph", current_user.id)
+        )
+        if cached:
+            return cached
         user = User.query.filter_by(id=id).first_or_404()
-        page = request.args.get("page", 1, type=int)
-        posts = Post.query.filter_by(user_id=user.id).order_by(Post.date_posted.desc())
-        pagin = (
-            Post.query.filter_by(user_id=user.id)
-            .order_by(Post.date_posted.desc())
-            .paginate(page=page, per_page=4)
+        pagin = load_feed(
+            Post.query.filter_by(user_id=user.id), current_user, total=user.post_count
         )
         # image_file = url_for('static', filename='profile_pics/' + user.picture)
         return render_template(
-            "user.html", user=user, page=page, pagin=pagin, posts=posts
+            "user.html", user=user, pagin=pagin
         )  # , image_file=image_file)
 
 
+def _follow_state(user):
+    """JSON for scripts, otherwise back to the profile; nothing is rendered."""
+    if request.headers.get("X-Requested-With") != "XMLHttpRequest":
+        return redirect(url_for(".user", id=user.id))
+    return jsonify(
+        user_id=user.id,
+        following=current_user.is_following(user),
+        followers=user.follower_count,
+    )
+
+
 @users.route("/follow/<int:id>", methods=["POST", "GET"])
+@login_required
 def follow(id):
-    user = User.query.filter_by(id=id).first()
-    # image_file = url_for('static', filename='profile_picutres/' + user.picture)
-    page = request.args.get("page", 1, type=int)
-    posts = Post.query.filter_by(user_id=user.id).order_by(Post.date_posted.desc())
-    pagin = (
-        Post.query.filter_by(user_id=user.id)
-        .order_by(Post.date_posted.desc())
-        .paginate(page=page, per_page=4)
-    )
-    if not current_user.is_following(user):
-        f = Follow(follower=current_user, followed=user)
-        db.session.add(f)
-        db.session.commit()
-    return render_template(
-        "user.html", user=user, page=page, pagin=pagin, posts=posts
-    )  # , image_file=image_file)
+    user = User.query.get_or_404(id)
+    if user.id != current_user.id and not current_user.is_following(user):
+        current_user.follow(user)
+        invalidate_totals(f"following:{current_user.id}")
+    return _follow_state(user)
 
 
 @users.route("/unfollow/<int:id>", methods=["POST", "GET"])
+@login_required
 def unfollow(id):
-    user = User.query.filter_by(id=id).first()
-    # image_file = url_for('static', filename='profile_picutres/' + user.picture)
-    page = request.args.get("page", 1, type=int)
-    posts = Post.query.filter_by(user_id=user.id).order_by(Post.date_posted.desc())
-    pagin = (
-        Post.query.filter_by(user_id=user.id)
-        .order_by(Post.date_posted.desc())
-        .paginate(page=page, per_page=4)
-    )
-    f = current_user.follower.filter_by(followed_id=user.id).first()
-    if f:
-        db.session.delete(f)
-        db.session.commit()
-    return render_template(
-        "user.html", user=user, page=page, pagin=pagin, posts=posts
-    )  # , image_file=image_file)
+    user = User.query.get_or_404(id)
+    if current_user.is_following(user):
+        current_user.unfollow(user)
+        invalidate_totals(f"following:{current_user.id}")
+    return _follow_state(user)
+
+
+@users.route("/api/follows", methods=["POST"])
+@login_required
+def batch_follow():
+    """Follow and unfollow lists of users at once.
+
+    Takes ``{"follow": [ids], "unfollow": [ids]}`` and returns the ids whose
+    state changed.
+    """
+    if request.headers.get("X-Requested-With") != "XMLHttpRequest":
+        abort(400)
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        abort(400)
+    follow_ids = data.get("follow", [])
+    unfollow_ids = data.get("unfollow", [])
+    if not isinstance(follow_ids, list) or not isinstance(unfollow_ids, list):
+        abort(400)
+    ids = follow_ids + unfollow_ids
+    # bools are ints too, but true is not user 1
+    if not all(type(user_id) is int for user_id in ids):
+        abort(400)
+    if len(ids) > current_app.config["FOLLOW_BATCH_LIMIT"]:
+        abort(413)
+    followed, unfollowed = current_user.update_follows(follow_ids, unfollow_ids)
+    if followed or unfollowed:
+        invalidate_totals(f"following:{current_user.id}")
+    return jsonify(followed=followed, unfollowed=unfollowed)
+
+
+@users.route("/check_availability")
+def check_availability():
+    """Tell the registration form whether a username or email is free.
+
+    Takes ``username`` and/or ``email`` query arguments and returns
+    ``{"username": true}`` style flags, true meaning available.
+    """
+    values = {
+        field: request.args[field]
+        for field in ("username", "email")
+        if request.args.get(field)
+    }
+    if not values:
+        abort(400)
+    taken = availability.taken(**values)
+    return jsonify({field: field not in taken for field in values})
 
 
 @users.route("/is_following/<int:id1>/<int:id2>", methods=["POST", "GET"])
 def is_following(id1, id2):
-    user1 = User.query.filter_by(id=id1).first()
-    user2 = User.query.filter_by(id=id2).first()
-    if user1 == None or user2 == None:
-        return False
-    return user1.follower.filter_by(followed_id=user2.id).first() is not None
+    return jsonify(following=follow_graph.is_following(id1, id2))
 
 
 @users.route("/is_followed_by/<int:id1>/<int:id2>", methods=["POST", "GET"])
 def is_followed_by(id1, id2):
-    user1 = User.query.filter_by(id=id1).first()
-    user2 = User.query.filter_by(id=id2).first()
-    if user1 == None or user2 == None:
-        return False
-    return user1.followed.filter_by(follower_id=user2.id).first() is not None
+    return jsonify(followed_by=follow_graph.is_following(id2, id1))
 
 
 @users.route("/forgot_password", methods=["POST", "GET"])
@@ -0,0 +1,37 @@
+"""Gunicorn settings for ``gunicorn -c gunicorn.conf.py run:app``.
+
+The app is imported once in the master and forked into the workers. Each
+worker serves ``threads`` requests at a time, so its connection pool gets
+one connection per thread unless DB_POOL_SIZE says otherwise.
+"""
+import multiprocessing
+import os
+
+cpus = multiprocessing.cpu_count()
+
+preload_app = True
+# one process per core for the CPU-bound part (templates, bcrypt), threads
+# to overlap the time spent waiting on the database
+workers = int(os.getenv("WEB_CONCURRENCY", cpus + 1))
+threads = int(os.getenv("GUNICORN_THREADS", min(2 * cpus, 8)))
+worker_class = "gthread"
+max_requests = 2000
+max_requests_jitter = 200
+
+os.environ.setdefault("DB_POOL_SIZE", str(threads))
+
+
+def pre_fork(server, worker):
+    # whatever the master connected to while importing the app must not be
+    # shared with the workers
+    if server.cfg.preload_app:
+        from app.pool import dispose_engines
+
+        dispose_engines(server.app.wsgi())
+
+
+def post_fork(server, worker):
+    from app.pool import pool_stats
+
+    # the counters describe this worker, not the master it was forked from
+    pool_stats.counts.clear()
@@ -0,0 +1,24 @@
+"""post excerpt
+
+Revision ID: 0b5e3f7a9c12
+Revises: f2a6d8c1e947
+Create Date: 2026-10-18 18:41:07.652981
+
+"""
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "0b5e3f7a9c12"
+down_revision = "f2a6d8c1e947"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # filled in by `flask markup backfill`
+    op.add_column("posts", sa.Column("excerpt", sa.String(length=280), nullable=True))
+
+
+def downgrade():
+    op.drop_column("posts", "excerpt")
@@ -0,0 +1,63 @@
+"""timeline entries
+
+Revision ID: 3c9d1e7a5b20
+Revises: b13fe03741e5
+Create Date: 2026-10-18 09:12:40.118230
+
+"""
+import sqlalchemy as sa
+from alembic import op
+from flask import current_app
+
+# revision identifiers, used by Alembic.
+revision = "3c9d1e7a5b20"
+down_revision = "b13fe03741e5"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "timeline_entries",
+        sa.Column("user_id", sa.Integer(), nullable=False),
+        sa.Column("date_posted", sa.DateTime(), nullable=False),
+        sa.Column("post_id", sa.Integer(), nullable=False),
+        sa.Column("author_id", sa.Integer(), nullable=True),
+        sa.ForeignKeyConstraint(["author_id"], ["users.id"]),
+        sa.ForeignKeyConstraint(["post_id"], ["posts.id"]),
+        sa.ForeignKeyConstraint(["user_id"], ["users.id"]),
+        sa.PrimaryKeyConstraint("user_id", "date_posted", "post_id"),
+    )
+    op.create_index(
+        "ix_timeline_entries_user_id_author_id",
+        "timeline_entries",
+        ["user_id", "author_id"],
+        unique=False,
+    )
+    op.create_index(
+        "ix_timeline_entries_post_id", "timeline_entries", ["post_id"], unique=False
+    )
+    # fill the timelines as app.timeline.rebuild() does: every author under
+    # the fan-out limit contributes their latest posts to each follower
+    op.get_bind().execute(
+        sa.text(
+            "INSERT INTO timeline_entries (user_id, date_posted, post_id, author_id) "
+            "SELECT follows.follower_id, ranked.date_posted, ranked.id, ranked.user_id "
+            "FROM follows JOIN (SELECT id, date_posted, user_id, row_number() OVER "
+            "(PARTITION BY user_id ORDER BY date_posted DESC, id DESC) AS recency "
+            "FROM posts) AS ranked ON ranked.user_id = follows.followed_id "
+            "WHERE ranked.recency <= :backfill AND follows.followed_id NOT IN "
+            "(SELECT followed_id FROM follows GROUP BY followed_id "
+            "HAVING count(*) > :limit)"
+        ),
+        backfill=current_app.config["TIMELINE_BACKFILL"],
+        limit=current_app.config["TIMELINE_FANOUT_LIMIT"],
+    )
+
+
+def downgrade():
+    op.drop_index("ix_timeline_entries_post_id", table_name="timeline_entries")
+    op.drop_index(
+        "ix_timeline_entries_user_id_author_id", table_name="timeline_entries"
+    )
+    op.drop_table("timeline_entries")
@@ -0,0 +1,30 @@
+"""post like count
+
+Revision ID: 5d7b91c0e2a4
+Revises: 8f4a2c6e1d93
+Create Date: 2026-10-18 13:41:26.774310
+
+"""
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "5d7b91c0e2a4"
+down_revision = "8f4a2c6e1d93"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column(
+        "posts",
+        sa.Column("like_count", sa.Integer(), server_default="0", nullable=False),
+    )
+    op.execute(
+        "UPDATE posts SET like_count = "
+        "(SELECT count(*) FROM likes WHERE likes.post_id = posts.id)"
+    )
+
+
+def downgrade():
+    op.drop_column("posts", "like_count")
@@ -0,0 +1,54 @@
+"""denormalized counters
+
+Revision ID: 7e1c4a9d2f68
+Revises: 0b5e3f7a9c12
+Create Date: 2026-10-18 19:26:53.408117
+
+"""
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "7e1c4a9d2f68"
+down_revision = "0b5e3f7a9c12"
+branch_labels = None
+depends_on = None
+
+# table, counter column and the count that fills it
+COUNTERS = (
+    (
+        "posts",
+        "comment_count",
+        "SELECT count(*) FROM comments "
+        "WHERE comments.post_id = posts.id AND NOT comments.deleted",
+    ),
+    (
+        "users",
+        "post_count",
+        "SELECT count(*) FROM posts WHERE posts.user_id = users.id AND NOT posts.deleted",
+    ),
+    (
+        "users",
+        "follower_count",
+        "SELECT count(*) FROM follows WHERE follows.followed_id = users.id",
+    ),
+    (
+        "users",
+        "following_count",
+        "SELECT count(*) FROM follows WHERE follows.follower_id = users.id",
+    ),
+)
+
+
+def upgrade():
+    for table, column, count in COUNTERS:
+        op.add_column(
+            table,
+            sa.Column(column, sa.Integer(), server_default="0", nullable=False),
+        )
+        op.execute(f"UPDATE {table} SET {column} = ({count})")
+
+
+def downgrade():
+    for table, column, _ in reversed(COUNTERS):
+        op.drop_column(table, column)
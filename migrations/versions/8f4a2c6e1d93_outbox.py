@@ -0,0 +1,38 @@
+"""outbox
+
+Revision ID: 8f4a2c6e1d93
+Revises: 3c9d1e7a5b20
+Create Date: 2026-10-18 10:03:11.502417
+
+"""
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "8f4a2c6e1d93"
+down_revision = "3c9d1e7a5b20"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "outbox",
+        sa.Column("id", sa.Integer(), autoincrement=True, nullable=False),
+        sa.Column("recipient", sa.String(length=120), nullable=False),
+        sa.Column("subject", sa.String(length=200), nullable=False),
+        sa.Column("body", sa.Text(), nullable=False),
+        sa.Column("created_at", sa.DateTime(), nullable=True),
+        sa.Column("next_attempt_at", sa.DateTime(), nullable=True),
+        sa.Column("attempts", sa.Integer(), nullable=False),
+        sa.Column("last_error", sa.Text(), nullable=True),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    op.create_index(
+        op.f("ix_outbox_next_attempt_at"), "outbox", ["next_attempt_at"], unique=False
+    )
+
+
+def downgrade():
+    op.drop_index(op.f("ix_outbox_next_attempt_at"), table_name="outbox")
+    op.drop_table("outbox")
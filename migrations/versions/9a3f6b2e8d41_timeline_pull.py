@@ -0,0 +1,38 @@
+"""timeline pull
+
+Revision ID: 9a3f6b2e8d41
+Revises: 7e1c4a9d2f68
+Create Date: 2026-10-18 20:31:16.240785
+
+"""
+import sqlalchemy as sa
+from alembic import op
+from flask import current_app
+
+# revision identifiers, used by Alembic.
+revision = "9a3f6b2e8d41"
+down_revision = "7e1c4a9d2f68"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column(
+        "users",
+        sa.Column(
+            "timeline_pull", sa.Boolean(), server_default=sa.false(), nullable=False
+        ),
+    )
+    # the authors the timeline fill skipped
+    op.get_bind().execute(
+        sa.text(
+            "UPDATE users SET timeline_pull = true WHERE id IN "
+            "(SELECT followed_id FROM follows GROUP BY followed_id "
+            "HAVING count(*) > :limit)"
+        ),
+        limit=current_app.config["TIMELINE_FANOUT_LIMIT"],
+    )
+
+
+def downgrade():
+    op.drop_column("users", "timeline_pull")
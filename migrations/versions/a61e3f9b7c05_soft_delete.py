@@ -0,0 +1,36 @@
+"""soft delete
+
+Revision ID: a61e3f9b7c05
+Revises: 5d7b91c0e2a4
+Create Date: 2026-10-18 15:02:48.391127
+
+"""
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "a61e3f9b7c05"
+down_revision = "5d7b91c0e2a4"
+branch_labels = None
+depends_on = None
+
+TABLES = ("users", "posts", "comments")
+
+
+def upgrade():
+    for table in TABLES:
+        op.add_column(
+            table,
+            sa.Column(
+                "deleted", sa.Boolean(), server_default=sa.false(), nullable=False
+            ),
+        )
+        op.add_column(table, sa.Column("deleted_at", sa.DateTime(), nullable=True))
+        op.create_index(f"ix_{table}_deleted_at", table, ["deleted_at"], unique=False)
+
+
+def downgrade():
+    for table in TABLES:
+        op.drop_index(f"ix_{table}_deleted_at", table_name=table)
+        op.drop_column(table, "deleted_at")
+        op.drop_column(table, "deleted")
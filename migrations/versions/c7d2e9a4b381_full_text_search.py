@@ -0,0 +1,87 @@
+"""full text search
+
+Revision ID: c7d2e9a4b381
+Revises: e4b8c2d7f150
+Create Date: 2026-10-18 17:22:09.518304
+
+"""
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "c7d2e9a4b381"
+down_revision = "e4b8c2d7f150"
+branch_labels = None
+depends_on = None
+
+DOCUMENTS = {
+    "posts": (("title", "A"), ("content", "B")),
+    "comments": (("body", "A"),),
+}
+
+
+def _vector(table, row=""):
+    return " || ".join(
+        f"setweight(to_tsvector('english', coalesce({row}{field}, '')), '{weight}')"
+        for field, weight in DOCUMENTS[table]
+    )
+
+
+def upgrade():
+    postgres = op.get_bind().dialect.name == "postgresql"
+    for table, fields in DOCUMENTS.items():
+        names = ", ".join(field for field, _ in fields)
+        if postgres:
+            op.execute(f"ALTER TABLE {table} ADD COLUMN search_vector tsvector")
+            op.execute(
+                f"CREATE FUNCTION {table}_search_vector() RETURNS trigger "
+                f"LANGUAGE plpgsql AS $$ BEGIN "
+                f"NEW.search_vector := {_vector(table, 'NEW.')}; RETURN NEW; END $$"
+            )
+            op.execute(
+                f"CREATE TRIGGER {table}_search_vector "
+                f"BEFORE INSERT OR UPDATE OF {names} ON {table} "
+                f"FOR EACH ROW EXECUTE PROCEDURE {table}_search_vector()"
+            )
+            op.execute(f"UPDATE {table} SET search_vector = {_vector(table)}")
+            op.execute(
+                f"CREATE INDEX ix_{table}_search_vector "
+                f"ON {table} USING gin (search_vector)"
+            )
+            continue
+        fts = f"{table}_fts"
+        old = ", ".join(f"old.{field}" for field, _ in fields)
+        new = ", ".join(f"new.{field}" for field, _ in fields)
+        remove = (
+            f"INSERT INTO {fts}({fts}, rowid, {names}) "
+            f"VALUES ('delete', old.id, {old});"
+        )
+        add = f"INSERT INTO {fts}(rowid, {names}) VALUES (new.id, {new});"
+        op.execute(
+            f"CREATE VIRTUAL TABLE {fts} USING fts5({names}, "
+            f"content='{table}', content_rowid='id', tokenize='porter unicode61')"
+        )
+        op.execute(
+            f"CREATE TRIGGER {fts}_insert AFTER INSERT ON {table} BEGIN {add} END"
+        )
+        op.execute(
+            f"CREATE TRIGGER {fts}_delete AFTER DELETE ON {table} BEGIN {remove} END"
+        )
+        op.execute(
+            f"CREATE TRIGGER {fts}_update AFTER UPDATE OF {names} ON {table} "
+            f"BEGIN {remove} {add} END"
+        )
+        op.execute(f"INSERT INTO {fts}({fts}) VALUES ('rebuild')")
+
+
+def downgrade():
+    postgres = op.get_bind().dialect.name == "postgresql"
+    for table in DOCUMENTS:
+        if postgres:
+            op.execute(f"DROP INDEX ix_{table}_search_vector")
+            op.execute(f"DROP TRIGGER {table}_search_vector ON {table}")
+            op.execute(f"DROP FUNCTION {table}_search_vector()")
+            op.execute(f"ALTER TABLE {table} DROP COLUMN search_vector")
+        else:
+            for event in ("insert", "delete", "update"):
+                op.execute(f"DROP TRIGGER {table}_fts_{event}")
+            op.execute(f"DROP TABLE {table}_fts")
@@ -0,0 +1,39 @@
+"""hot path indexes
+
+Revision ID: e4b8c2d7f150
+Revises: a61e3f9b7c05
+Create Date: 2026-10-18 16:05:12.402117
+
+"""
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "e4b8c2d7f150"
+down_revision = "a61e3f9b7c05"
+branch_labels = None
+depends_on = None
+
+INDEXES = [
+    ("ix_posts_date_posted_id", "posts", ["date_posted", "id"]),
+    ("ix_posts_user_id_date_posted_id", "posts", ["user_id", "date_posted", "id"]),
+    (
+        "ix_comments_post_id_timestamp_id",
+        "comments",
+        ["post_id", "timestamp", "id"],
+    ),
+    ("ix_comments_author_id", "comments", ["author_id"]),
+    ("ix_likes_post_id", "likes", ["post_id"]),
+    ("ix_follows_followed_id", "follows", ["followed_id"]),
+    ("ix_users_email", "users", ["email"]),
+    ("ix_users_username", "users", ["username"]),
+]
+
+
+def upgrade():
+    for name, table, columns in INDEXES:
+        op.create_index(name, table, columns, unique=False)
+
+
+def downgrade():
+    for name, table, _ in reversed(INDEXES):
+        op.drop_index(name, table_name=table)
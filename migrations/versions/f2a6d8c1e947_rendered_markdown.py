@@ -0,0 +1,26 @@
+"""rendered markdown
+
+Revision ID: f2a6d8c1e947
+Revises: c7d2e9a4b381
+Create Date: 2026-10-18 18:05:42.113529
+
+"""
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "f2a6d8c1e947"
+down_revision = "c7d2e9a4b381"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # filled in by `flask markup backfill`
+    op.add_column("posts", sa.Column("content_html", sa.Text(), nullable=True))
+    op.add_column("comments", sa.Column("body_html", sa.Text(), nullable=True))
+
+
+def downgrade():
+    op.drop_column("comments", "body_html")
+    op.drop_column("posts", "content_html")
@@ -4,8 +4,26 @@ import sys
 import click
 
 from app import create_app, db
+from app.advisor import advise_cli
+from app.assets import assets_cli
+from app.bench import bench_cli
+from app.counters import counters_cli
+from app.data import data_cli
+from app.markup import markup_cli
+from app.outbox import outbox_cli
+from app.purge import purge_cli
+from app.search import search_cli
 
 app = create_app()
+app.cli.add_command(outbox_cli)
+app.cli.add_command(bench_cli)
+app.cli.add_command(data_cli)
+app.cli.add_command(purge_cli)
+app.cli.add_command(assets_cli)
+app.cli.add_command(search_cli)
+app.cli.add_command(markup_cli)
+app.cli.add_command(counters_cli)
+app.cli.add_command(advise_cli)
 
 if __name__ == "__main__":
     app.run(debug=True)